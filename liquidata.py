@@ -1,12 +1,45 @@
-from operator    import itemgetter, attrgetter
-from functools   import reduce, wraps
-from collections import namedtuple
+from operator    import itemgetter, attrgetter, methodcaller
+from functools   import reduce, wraps, lru_cache, partial
+from collections import namedtuple, deque, Counter, OrderedDict
+from bisect      import bisect_right
 from contextlib  import contextmanager
-from argparse    import Namespace
-from asyncio     import Future
+from types       import FunctionType, MethodType, BuiltinFunctionType
+from types       import CoroutineType, GeneratorType, AsyncGeneratorType
 
 import itertools as it
-import copy
+import threading
+import heapq
+import math
+import os
+import sys
+import reprlib # imported by functools anyway
+import time
+
+
+# Modules which are slow to import, and needed only by some pipes, are
+# imported on first use, when they replace their stand-ins in this module.
+class _LazyModule:
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        module = __import__(self._name)
+        globals()[self._name] = module
+        return getattr(module, attr)
+
+argparse = _LazyModule('argparse') # for Namespace
+copy     = _LazyModule('copy')
+re       = _LazyModule('re')
+
+# Code flags, as in inspect (which is slower to import than the rest of liquidata)
+CO_COROUTINE, CO_ASYNC_GENERATOR = 0x80, 0x200
+
+# Namespace was once imported here, directly from argparse
+def __getattr__(name):
+    if name == 'Namespace':
+        return argparse.Namespace
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 
@@ -18,28 +51,16 @@ import copy
 
 # TODO: add `keep` and `lose` as explicit names for filter and its complement
 
-# TODO: grouping utilities
-
 # TODO: count-filter: implicit {} in out: out.NAME({predicate}) -> .passed & .stopped
 
-# TODO: send down one branch or other depending on predicate. dispatch, match, divert, split
-
 # TODO: test for new exception types: SinkMissing, NeedAtLeastOneCoroutine
 
 # TODO: think about whether `into` or `_Fold` should be the default `out`.
 
-# TODO: find constant-space implementation of into
-
 # TODO: implement _Fold in terms of into(reduce(...)), but only once into is constant-space
 
-# TODO: automatic reinitialization of pipe.fn() after exception or other close.
-
 # TODO: return namedtuple rather than namespace? Would allow unpacking.
 
-# TODO: missing arg-lambda features
-#         arg.a > 3;          arg[0] > 3;          arg.a > arg.b          arg.a  ; arg.a.b  arg[0,1]
-# lambda x: x.a > 3; lambda x: x:[0] > 3; lambda a,b : a >     b; attrgetter('a');
-
 # TODO: (a,b,c) without args or put should just be a pipe
 
 # TODO: print_every(n)  [slice(None, None, n), print]
@@ -67,8 +88,6 @@ import copy
 # TODO: spy(side-effect),  spy.X(result-sink) as synonyms for
 #          [side-effect], [out.X(result-sink)] ????
 
-# TODO: add pipe.fn(Exception) alongside pipe.fn() and pipe.fn(tuple)
-
 # TODO: typecheck: an alternative to __call__ which, rather than compiling and
 #       composing coroutines, tries to perform typechecking on the composition
 #       of the components.
@@ -78,43 +97,170 @@ import copy
 
 class pipe:
 
-    def __new__(cls, *components):
+    def __new__(cls, *components, **options):
         self = super().__new__(cls)
         if isinstance(components[0], source):
-            self.__init__(*components[1:])
+            self.__init__(*components[1:], **options)
             return self(components[0].it)
         return self
 
-    def __init__(self, *components):
+    def __init__(self, *components, batch=None, columns=None, concurrency=16):
+        if batch   is not None and batch   < 1: raise ValueError('batch size must be >= 1')
+        if columns is not None and columns < 1: raise ValueError('column length must be >= 1')
+        if batch   is not None and columns    : raise ValueError('choose one of batch and columns')
+        if concurrency < 1                    : raise ValueError('concurrency must be >= 1')
         self._components = components
-
-    def coroutine_and_outputs(self):
-        decoded_components = map(decode_implicits, self._components)
-        cor_out_pairs = tuple(c.coroutine_and_outputs() for c in decoded_components)
+        self._batch = batch
+        self._columns = columns
+        self._concurrency = concurrency
+        self._options = dict(batch=batch, columns=columns, concurrency=concurrency)
+        self._decoded = {}
+        self._capped = None
+
+    # Pipes are sent to worker processes by `pipe.parallel`, without their
+    # caches, which hold compiled (and unpicklable) functions.
+    def __reduce__(self):
+        return partial(pipe, **self._options), self._components
+
+    # Decoding (and fusing) the components is done only once per pipe: each
+    # call builds fresh coroutines, futures and accumulators from the result.
+    def decoded_components(self, fused=None):
+        fused = FUSE if fused is None else fused
+        if fused not in self._decoded:
+            decoded = map(decode_implicits, self._components)
+            self._decoded[fused] = tuple(fuse(decoded) if fused else decoded)
+        return self._decoded[fused]
+
+    def coroutine_and_outputs(self, cap=()):
+        return self._network('coroutine_and_outputs', cap)
+
+    def batch_coroutine_and_outputs(self):
+        return self._network('batch_coroutine_and_outputs')
+
+    def column_coroutine_and_outputs(self):
+        return self._network('column_coroutine_and_outputs')
+
+    def _network(self, method, cap=()):
+        build, profile = methodcaller(method), profiling.current
+        if profile and profile.wants_network():
+            components = self.decoded_components(fused=False) + cap
+            cor_out_pairs = profile.instrument(noting_stoppers(build, components), components,
+                                               items=method == 'coroutine_and_outputs')
+        else:
+            components = self.decoded_components() + cap
+            cor_out_pairs = tuple(map(noting_stoppers(build, components), components))
         coroutines = map(itemgetter(0), cor_out_pairs)
         out_groups = map(itemgetter(1), cor_out_pairs)
         return combine_coroutines(coroutines), it.chain(*out_groups)
 
+    # If the source is an async iterable, or any component is an async function
+    # (or async generator in `flat`), the result must be awaited. Asynchronous
+    # pipes always run item by item.
     def __call__(self, source):
-        coroutine, outputs = self.ensure_capped().coroutine_and_outputs()
-        push(source, coroutine)
-        return self.collect_returns(outputs)
+        return self._run(source, self.collect_returns)
+
+    def _run(self, source, collect):
+        capped = self.ensure_capped()
+        asynchronous = hasattr(source, '__aiter__')
+        with _AsyncContext(self._concurrency) as context:
+            if   asynchronous              : coroutine, outputs = capped.       coroutine_and_outputs()
+            elif self._columns is not None : coroutine, outputs = capped.column_coroutine_and_outputs()
+            elif self._batch   is not None : coroutine, outputs = capped. batch_coroutine_and_outputs()
+            else                           : coroutine, outputs = capped.       coroutine_and_outputs()
+        if asynchronous or context.stages:
+            return context.run(source, coroutine, partial(collect, outputs))
+        if   self._columns is not None: push_columns(source, coroutine, self._columns)
+        elif self._batch   is not None: push_batches(source, coroutine, self._batch)
+        else                          : push        (source, coroutine)
+        return collect(outputs)
+
+    # Returns an iterator over the items which reach the end of the pipe,
+    # reading from the source only as fast as the iterator is consumed.
+    # Named outputs are discarded. Abandoning the iterator closes the network
+    # (and the source, if it is a generator).
+    def iter(self, source):
+        if hasattr(source, '__aiter__'):
+            raise AsyncUnsupported('pipe.iter() cannot pull from an asynchronous source')
+        if self.ensure_capped() is self:
+            raise ValueError('pipe.iter() needs a pipe which does not end in an output or sink')
+        ready = deque()
+        cap   = (sink(ready.append),)
+        if   self._columns is not None: method, size = 'column_coroutine_and_outputs', self._columns
+        elif self._batch   is not None: method, size = 'batch_coroutine_and_outputs' , self._batch
+        else                          : method, size = 'coroutine_and_outputs'       , None
+        network, _ = self._network(method, cap)
+        if size is None: items = source = iter(source)
+        else           : items, source  = batches_of(source, size)
+        if self._columns is not None:
+            items = map(column_of, items)
+        return pull(items, network, ready, source)
+
+    # Runs the pipe over each of the `partitions` (each one a source) in a pool
+    # of worker processes, and merges each output's results across partitions:
+    # lists are concatenated, counts and sums added, keyed folds merged key by
+    # key and folds (without `initial`) over add, mul, min, max, and_, or_ or
+    # xor reduced with their own function. Other outputs must declare how to
+    # merge: out.X(..., combine=binary_fn).
+    # The pipe is pickled, so its functions must be defined at module level.
+    def parallel(self, partitions, workers=None):
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers, initializer=_set_partition_pipe, initargs=(self,)) as executor:
+            results = tuple(executor.map(_run_partition, partitions))
+        if not results:
+            return self(())
+        return self.format_returns(map(combine_partitions, zip(*results)))
+
+    # Runs the pipe, unfused, with every stage instrumented. Returns a Profile
+    # holding the pipe's result and the per-stage counts and timings.
+    def profile(self, source):
+        if hasattr(source, '__aiter__'):
+            raise AsyncUnsupported('only synchronous pipes can be profiled')
+        with Profile() as profile:
+            result = self(source)
+        if isinstance(result, CoroutineType):
+            result.close()
+            raise AsyncUnsupported('only synchronous pipes can be profiled')
+        profile.result = result
+        return profile
 
     @staticmethod
     def collect_returns(outputs):
-        outputs = tuple(outputs)
-        returns = tuple(filter(lambda o: o.name == 'return', outputs))
-        out_ns  = Namespace(**{o.name: o.future.result() for o in outputs})
+        return pipe.format_returns((o.name, o.future.result()) for o in outputs)
+
+    @staticmethod
+    def format_returns(results):
+        results = tuple(results)
+        returns = tuple(result for name, result in results if name == 'return')
+        out_ns  = argparse.Namespace(**dict(results))
         if len(vars(out_ns)) == len(returns) == 1:
-            return vars(out_ns)['return']
-        setattr(out_ns, 'return', tuple(r.future.result() for r in returns))
+            return returns[0]
+        setattr(out_ns, 'return', returns)
         return out_ns
 
     def pipe(self):
-        return flat(self.fn(tuple))
+        return _Pipe(self)
+
+    # The structure of the network, without building it: see Graph
+    def graph(self):
+        return Graph.of(self)
+
+    # Raises InvalidPipe, listing the problems in the pipe's graph, if it has
+    # any. Checking ahead of time is cheaper than failing part-way through.
+    def validate(self):
+        problems = self.graph().problems()
+        if problems:
+            raise InvalidPipe('\n'.join(problems))
+        return self
 
+    # pipe.fn(SomeException) returns, rather than raises, any SomeException
+    # raised by the network, so that a bad input fails only its own call.
     def fn(self, many=None):
-        the_function = pipe._Fn(self._components)
+        errors = ()
+        if isinstance(many, type) and issubclass(many, BaseException):
+            errors, many = many, None
+        the_function = self._composed() or pipe._Fn(self)
+        if errors:
+            the_function = isolated(the_function, errors)
         if many is tuple:
             return the_function
         def fn(*args):
@@ -124,26 +270,111 @@ class pipe:
             else               : return Void
         return fn
 
+    # A pipe made only of maps (such as most `put` and `on` actions) can be
+    # called as a plain composition of its functions, without a network. Like
+    # the network, it returns nothing once a function has stopped it.
+    def _composed(self):
+        components = self.decoded_components(fused=False)
+        if profiling.current or not components or any(type(c) is not _Map for c in components):
+            return None
+        first, *rest = (evaluator(c._args[0]) for c in components)
+        finished = False
+        def composed(*args):
+            nonlocal finished
+            if finished:
+                return ()
+            try:
+                x = first(*args)
+                for fn in rest:
+                    x = fn(x)
+            except StopPipeline:
+                finished = True
+                return ()
+            return (x,)
+        return composed
+
     def ensure_capped(self):
-        last = self._components[-1]
-        is_capped = (isinstance(last, (sink, _Return, _Return.Name)) or
-                     isinstance(last, _Name) and last.constructor == _Return.Name)
-        return self if is_capped else pipe(*self._components, out)
+        if self._capped is None:
+            capped = is_cap(self._components[-1])
+            self._capped = self if capped else pipe(*self._components, out, **self._options)
+        return self._capped
 
     class _Fn:
 
-        def __init__(self, components):
-            self._pipe = pipe(*it.chain(components, [sink(self.accept_result)]))
-            self._coroutine, _ = self._pipe.coroutine_and_outputs()
-
+        def __init__(self, the_pipe):
+            self._pipe    = the_pipe
+            self._starred = None
+            self._build()
+
+        def _build(self):
+            cap = (sink(self.accept_result),)
+            with building_function:
+                self._coroutine, _ = self._pipe.coroutine_and_outputs(cap)
+            self._finished = False
+
+        # Once the network has finished (e.g. a `take` in it is satisfied) it
+        # returns nothing, but the finish does not spread to the caller. An
+        # exception kills the network: it is rebuilt (from the already decoded
+        # components) on the next call.
         def __call__(self, *args):
+            if len(args) != 1:
+                return self._call_starred(args)
             self._returns = []
-            self._coroutine.send(args)
+            if self._coroutine is None:
+                self._build()
+            if not self._finished:
+                try:
+                    self._coroutine.send(args[0])
+                except (_Finished, StopPipeline):
+                    self._finished = True
+                except BaseException:
+                    self._coroutine = None
+                    raise
             return tuple(self._returns)
 
+        # Networks pass single items, so several arguments are sent as one
+        # tuple, to a network in which the functions which first receive it
+        # unpack it (see starred)
+        def _call_starred(self, args):
+            if self._starred is None:
+                self._starred = pipe._Fn(pipe(*starred(self._pipe._components), **self._pipe._options))
+            return self._starred(args)
+
         def accept_result(self, item):
             self._returns.append(item)
 
+# The pipe run by pipe.parallel's worker processes
+_partition_pipe = None
+
+def _set_partition_pipe(the_pipe):
+    global _partition_pipe
+    _partition_pipe = the_pipe
+
+def _run_partition(partition):
+    result = _partition_pipe._run(partition, partition_results)
+    if isinstance(result, CoroutineType):
+        import asyncio
+        result = asyncio.run(result)
+    return result
+
+def partition_results(outputs):
+    return tuple((o.name, o.future.result(), o.combine) for o in outputs)
+
+def combine_partitions(results):
+    (name, _, combine), values = results[0], tuple(value for _, value, _ in results)
+    if combine is None and len(values) > 1:
+        raise CombinerMissing(f'results of out.{name} cannot be merged: give it combine=...')
+    return name, reduce(combine, values) if len(values) > 1 else values[0]
+
+
+def isolated(fn, errors):
+    def isolated(*args):
+        try:
+            return fn(*args)
+        except errors as error:
+            return (error,)
+    return isolated
+
 ######################################################################
 #    Component types                                                 #
 ######################################################################
@@ -163,7 +394,18 @@ class source(metaclass=_Source):
 
 
 class _Component:
-    pass
+
+    # Components without a specialized batch loop are run item by item inside
+    # an adapter which speaks the batch protocol.
+    def batch_coroutine_and_outputs(self):
+        coroutine, outputs = self.coroutine_and_outputs()
+        return unbatched(coroutine), outputs
+
+    # Components which cannot work on whole columns see them as batches of
+    # plain Python values.
+    def column_coroutine_and_outputs(self):
+        coroutine, outputs = self.batch_coroutine_and_outputs()
+        return as_lists(coroutine), outputs
 
 
 def component(loop):
@@ -175,67 +417,216 @@ def component(loop):
         if loop.__name__ == 'sink': return coroutine(loop(*self._args))(), ()
         else                      : return coroutine(loop(*self._args))  , ()
 
+    def batch_coroutine_and_outputs(self):
+        batch_loop = type(self)._batch_loop
+        if batch_loop is None       : return _Component.batch_coroutine_and_outputs(self)
+        if loop.__name__ == 'sink': return coroutine(batch_loop(*self._args))(), ()
+        else                      : return coroutine(batch_loop(*self._args))  , ()
+
+    def column_coroutine_and_outputs(self):
+        column_loop = type(self)._column_loop
+        loop = column_loop and column_loop(*self._args)
+        if loop is None: return _Component.column_coroutine_and_outputs(self)
+        else           : return coroutine(loop), ()
+
     def star(self):
         first, *rest = self._args
         return type(self)(_star(first), *rest)
 
-    ns = dict(__init__=__init__, coroutine_and_outputs=coroutine_and_outputs, star=star)
+    ns = dict(__init__=__init__, coroutine_and_outputs=coroutine_and_outputs,
+              batch_coroutine_and_outputs=batch_coroutine_and_outputs,
+              column_coroutine_and_outputs=column_coroutine_and_outputs, star=star,
+              _batch_loop=None, _column_loop=None)
 
     return type(loop.__name__, (_Component,), ns)
 
 
+def batched(component_type):
+    def register(batch_loop):
+        component_type._batch_loop = staticmethod(batch_loop)
+        return component_type
+    return register
+
+
+# Column loops return None when the component's functions cannot be applied
+# to whole arrays.
+def columnar(component_type):
+    def register(column_loop):
+        component_type._column_loop = staticmethod(column_loop)
+        return component_type
+    return register
+
+# In item mode each coroutine is sent the items themselves, one at a time,
+# without wrapping them in argument tuples. In batch mode each coroutine
+# receives a non-empty list of items. When the pipeline is stopped part-way through a batch,
+# StopPipeline.index records the position (within the batch received by the
+# stage which sees the exception) of the item which caused the stop, so that
+# branches can forward the items they would have seen in item mode (see
+# _Branch._batch_branch for the one case where they cannot).
+
+
 @component
 def sink(fn):
     def sink_loop():
         while True:
-            fn(*(yield))
+            fn((yield))
     return sink_loop
 
 
+@batched(sink)
+def sink(fn):
+    def sink_batch_loop():
+        while True:
+            batch = yield
+            index = 0
+            try:
+                for index, item in enumerate(batch):
+                    fn(item)
+            except StopPipeline as stop:
+                raise stopped(stop, index)
+    return sink_batch_loop
+
+
 @component
 def _Map(fn):
+    fn = evaluator(fn)
     def map_loop(downstream):
         with closing(downstream):
             while True:
-                downstream.send((fn(*(yield)),))
+                downstream.send(fn((yield)))
     return map_loop
 
 
+@batched(_Map)
+def _Map(fn):
+    fn = evaluator(fn)
+    def map_batch_loop(downstream):
+        with closing(downstream):
+            while True:
+                batch = yield
+                mapped = []
+                try:
+                    mapped.extend(map(fn, batch))
+                except StopPipeline as stop:
+                    if mapped: downstream.send(mapped)
+                    raise stopped(stop, len(mapped))
+                downstream.send(mapped)
+    return map_batch_loop
+
+
+@columnar(_Map)
+def _Map(fn):
+    if not vectorised(fn):
+        return None
+    def map_column_loop(downstream):
+        with closing(downstream):
+            while True:
+                downstream.send(column_apply(fn, (yield)))
+    return map_column_loop
+
+
 @component
 def flat(fn):
     def flat_loop(downstream):
         with closing(downstream):
             while True:
-                for item in fn(*(yield)):
-                    downstream.send((item,))
+                for item in fn((yield)):
+                    downstream.send(item)
     return flat_loop
 
 
+@batched(flat)
+def flat(fn):
+    def flat_batch_loop(downstream):
+        with closing(downstream):
+            while True:
+                batch = yield
+                flattened, ends = [], []
+                try:
+                    for item in batch:
+                        flattened.extend(fn(item))
+                        ends.append(len(flattened))
+                except StopPipeline as stop:
+                    send_batch(downstream, flattened, ends_origin(ends))
+                    raise stopped(stop, len(ends))
+                send_batch(downstream, flattened, ends_origin(ends))
+    return flat_batch_loop
+
+
 @component
 def join():
     def join_loop(downstream):
         with closing(downstream):
             while True:
-                upstream, = yield
+                upstream = yield
                 for item in upstream:
-                    downstream.send((item,))
+                    downstream.send(item)
     return join_loop
+
+
+@batched(join)
+def join():
+    def join_batch_loop(downstream):
+        with closing(downstream):
+            while True:
+                batch = yield
+                joined, ends = [], []
+                for upstream in batch:
+                    joined.extend(upstream)
+                    ends.append(len(joined))
+                send_batch(downstream, joined, ends_origin(ends))
+    return join_batch_loop
 join = join()
 
 
 @component
 def _Filter(predicate, key=None):
-    if key is None:
-        key = lambda x:x
+    predicate, key = evaluator(predicate), evaluator(key)
+    if key is not None:
+        def predicate(item, predicate=predicate):
+            return predicate(key(item))
     def filter_loop(downstream):
         with closing(downstream):
             while True:
-                args = yield
-                if predicate(key(*args)):
-                    downstream.send(args)
+                item = yield
+                if predicate(item):
+                    downstream.send(item)
     return filter_loop
 
 
+@batched(_Filter)
+def _Filter(predicate, key=None):
+    predicate, key = evaluator(predicate), evaluator(key)
+    if key is not None:
+        def predicate(item, predicate=predicate):
+            return predicate(key(item))
+    def filter_batch_loop(downstream):
+        with closing(downstream):
+            while True:
+                batch = yield
+                passed = []
+                try:
+                    passed.extend(map(predicate, batch))
+                except StopPipeline as stop:
+                    send_batch(downstream, list(it.compress(batch, passed)), mask_origin(passed))
+                    raise stopped(stop, len(passed))
+                send_batch(downstream, list(it.compress(batch, passed)), mask_origin(passed))
+    return filter_batch_loop
+
+
+@columnar(_Filter)
+def _Filter(predicate, key=None):
+    if not vectorised(predicate) or key is not None and not vectorised(key):
+        return None
+    def filter_column_loop(downstream):
+        with closing(downstream):
+            while True:
+                column = yield
+                passed = column[column_mask(predicate, column, key)]
+                if len(passed): downstream.send(passed)
+    return filter_column_loop
+
+
 class _Branch(_Component):
 
     def __init__(self, *components):
@@ -247,34 +638,282 @@ class _Branch(_Component):
         def branch_loop(downstream):
             with closing(sideways), closing(downstream):
                 while True:
-                    args = yield
-                    sideways  .send(args)
-                    downstream.send(args)
+                    item = yield
+                    try:
+                        sideways.send(item)
+                    except _Finished:
+                        downstream.send(item)
+                        yield from forward_to(downstream)
+                    try:
+                        downstream.send(item)
+                    except _Finished:
+                        yield from forward_to(sideways)
         return branch_loop, outputs
 
+    def batch_coroutine_and_outputs(self):
+        downstream_stops = stop_build.downstream
+        return self._batch_branch(downstream_stops, *self._pipe.ensure_capped().batch_coroutine_and_outputs())
+
+    def column_coroutine_and_outputs(self):
+        downstream_stops = stop_build.downstream
+        return self._batch_branch(downstream_stops, *self._pipe.ensure_capped().column_coroutine_and_outputs())
+
+    # In item mode the branch sees each item before downstream does, so
+    # whichever side stops the pipeline first, the other sees exactly the
+    # items before the stop (plus the stopping item itself, for the branch).
+    # In batch mode the side which can stop the pipeline is sent each batch
+    # first, and the other is then sent only the items it would have seen. If
+    # both sides can stop it, items are sent one at a time. Only the library's
+    # own stoppers (close_all) are known in advance: a StopPipeline raised by a
+    # user function downstream of the branch comes after the branch has seen
+    # the whole batch.
+    def _batch_branch(self, downstream_stops, sideways, outputs):
+        side_stops = any(map(can_stop, self._pipe.decoded_components()))
+        if downstream_stops and not side_stops: lead, step = 1, None
+        else                                  : lead, step = 0, 1 if downstream_stops else None
+        @coroutine
+        def branch_batch_loop(downstream):
+            first, second = (downstream, sideways) if lead else (sideways, downstream)
+            with closing(sideways), closing(downstream):
+                while True:
+                    batch = yield
+                    for start in range(0, len(batch), step or len(batch)):
+                        part = batch[start:start + step] if step else batch
+                        # Sent to the second side. While it exists, items in
+                        # the batch are not updated in place (see _Put) by
+                        # either side.
+                        own_part = part.copy()
+                        try:
+                            first.send(part)
+                        except StopPipeline as stop:
+                            index = stop.index or 0
+                            try:
+                                send_batch(second, part[:index + lead], start.__add__)
+                            except _Finished:
+                                pass
+                            raise stopped(stop, start + index)
+                        except _Finished:
+                            send_batch(second, batch[start:], start.__add__)
+                            yield from forward_to(second)
+                        try:
+                            send_batch(second, own_part, start.__add__)
+                        except _Finished:
+                            send_batch(first, batch[start + len(part):], (start + len(part)).__add__)
+                            yield from forward_to(first)
+        return branch_batch_loop, outputs
+
+
+# Whether a component can stop the whole pipeline (rather than just finish)
+def can_stop(component):
+    if isinstance(component, Slice)   : return component.close_all
+    if isinstance(component, _Branch) : return any(map(can_stop, component._pipe.decoded_components()))
+    if isinstance(component, dispatch):
+        routes = (*component._cases.values(), *filter(None, (component._default,)))
+        return any(can_stop(c) for route in routes for c in route.decoded_components())
+    return False
+
+
+# While a network is built, whether any component after the one being built
+# can stop the pipeline: branches need to know, in batch mode.
+class _StopBuild(threading.local):
+    downstream = False
+
+stop_build = _StopBuild()
+
+
+# Builds each of `components` (in order), noting first whether anything after
+# it can stop the pipeline.
+def noting_stoppers(build, components):
+    later = it.accumulate(it.chain((False,), map(can_stop, reversed(components[1:]))), or_)
+    flags = iter(tuple(later)[::-1])
+    def build_noting(component):
+        stop_build.downstream = next(flags)
+        return build(component)
+    return build_noting
+
+
+# Sends each item down exactly one route, chosen by looking up `key(item)` in
+# `cases`: a dict mapping key values to branches (a component, or a list or
+# tuple of components, as inside `[...]`). Items whose key has no case go to
+# `default` if it is given; otherwise they carry on downstream of the dispatch.
+# The outputs of all the branches are merged into the pipe's result. As with
+# branches, if the pipeline is stopped part-way through a batch, the other
+# routes will already have seen the remainder of that batch.
+class dispatch(_Component):
+
+    def __init__(self, key, cases, default=None):
+        self._key     = key
+        self._cases   = {value: self.branch(case) for value, case in cases.items()}
+        self._default = None if default is None else self.branch(default)
+
+    @staticmethod
+    def branch(case):
+        if not isinstance(case, (list, tuple)):
+            case = (case,)
+        return pipe(*case)
+
+    def coroutine_and_outputs(self):
+        key, (branches, default, outputs) = evaluator(self._key), self._build('coroutine_and_outputs')
+        @coroutine
+        def dispatch_loop(downstream):
+            routes = _Routes(branches, default, downstream)
+            with routes:
+                lookup, fallback = routes.lookup, routes.fallback
+                while True:
+                    item = yield
+                    target = lookup(key(item), fallback)
+                    try:
+                        target.send(item)
+                    except _Finished:
+                        fallback = routes.finished(target)
+        return dispatch_loop, outputs
+
+    def batch_coroutine_and_outputs(self):
+        key, (branches, default, outputs) = evaluator(self._key), self._build('batch_coroutine_and_outputs')
+        @coroutine
+        def dispatch_batch_loop(downstream):
+            routes = _Routes(branches, default, downstream)
+            with routes:
+                lookup, fallback = routes.lookup, routes.fallback
+                while True:
+                    batch = yield
+                    partitions = {}
+                    for index, item in enumerate(batch):
+                        target = lookup(key(item), fallback)
+                        partition = partitions.get(target)
+                        if partition is None:
+                            partition = partitions[target] = [], []
+                        partition[0].append(item)
+                        partition[1].append(index)
+                    for target, (items, origins) in partitions.items():
+                        try:
+                            send_batch(target, items, origins.__getitem__)
+                        except _Finished:
+                            fallback = routes.finished(target)
+        return dispatch_batch_loop, outputs
+
+    def _build(self, method):
+        build, outputs = methodcaller(method), []
+        def capped(branch):
+            coroutine, branch_outputs = build(branch.ensure_capped())
+            outputs.extend(branch_outputs)
+            return coroutine
+        branches = {value: capped(branch) for value, branch in self._cases.items()}
+        default  = None if self._default is None else capped(self._default)
+        return branches, default, tuple(outputs)
+
+
+# The live routes of a dispatch. Finished routes are replaced by one which
+# discards items; once every route has finished, so has the dispatch.
+# `finished` returns the (possibly replaced) fallback route: `default` if
+# given, otherwise downstream. Downstream is closed with the routes even when
+# it is sent nothing.
+class _Routes:
+
+    def __init__(self, branches, default, downstream):
+        fallback      = downstream if default is None else default
+        self.all      = (*branches.values(), fallback)
+        self.closing  = self.all if default is None else (*self.all, downstream)
+        self.live     = set(self.all)
+        self.routes   = dict(branches)
+        self.lookup   = self.routes.get
+        self.fallback = fallback
+
+    def finished(self, target):
+        self.live.discard(target)
+        if not self.live:
+            raise _Finished
+        self.routes.update((value, _discard) for value, route in self.routes.items() if route is target)
+        if self.fallback is target:
+            self.fallback = _discard
+        return self.fallback
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for route in self.closing:
+            route.close()
+
 
+class _Discard:
+    def send(self, item): pass
+    def close(self)     : pass
+
+_discard = _Discard()
+
+
+# A pipe used as a component of another pipe. A fresh function is made from the
+# inner pipe every time the network is built, so that state in the inner pipe
+# does not leak between calls of the outer one.
+class _Pipe(_Component):
+
+    def __init__(self, the_pipe, starred=False):
+        self._pipe = the_pipe
+        self._starred = starred
+
+    def _flat(self):
+        fn = self._pipe.fn(tuple)
+        return flat(_star(fn) if self._starred else fn)
+
+    def coroutine_and_outputs(self):
+        return self._flat().coroutine_and_outputs()
+
+    def batch_coroutine_and_outputs(self):
+        return self._flat().batch_coroutine_and_outputs()
+
+    def column_coroutine_and_outputs(self):
+        return self._flat().column_coroutine_and_outputs()
+
+    def star(self):
+        return _Pipe(self._pipe, starred=True)
+
+
+# into(consumer) calls consumer (on the thread running the pipe) with an
+# iterable of the items. With lazy=True, other than for the consumers which
+# are fed incrementally anyway (see into_consumer), the consumer runs in a
+# thread of its own, iterating over the items as they arrive, so that the
+# stream is never held in memory: thread-bound consumers (e.g. ones writing
+# through an sqlite3 connection) and ones relying on thread-local or context
+# state must not be lazy.
 class into:
 
-    def __init__(self, consumer):
+    def __init__(self, consumer, lazy=False):
         self.consumer = consumer
+        self.lazy = lazy
 
 
 class _Return(_Component):
 
-    def __init__(self, name, sink=None, initial=None, key=None):
+    def __init__(self, name, sink=None, initial=None, key=None, by=None, fold=None, value=None, top=None,
+                 combine=None):
         self._name = name
 
-        if       isinstance(sink, set       ): sink = _CountFilter(sink, key=key)
-        elif     isinstance(sink, into      ): sink = into_consumer(sink.consumer)
+        if fold is not None: sink = fold
+        if by   is not None and isinstance(sink, into): sink = _Fold(_append, [], sink.consumer) # per key
+        if by   is not None: sink = _KeyedFold(by, list if sink is None else sink, initial, value, top)
+        elif     isinstance(sink, set       ): sink = _CountFilter(sink, key=key)
+        elif     isinstance(sink, into      ): sink = into_consumer(sink.consumer, sink.lazy)
         elif not isinstance(sink, _Component): sink = _Fold(sink, initial=initial)
         # TODO: issue warning/error if initial is not None
         # TODO: set as implicit count filter?
         self._sink = sink
+        self._combine = sink.combiner() if combine is None else combine
 
     def coroutine_and_outputs(self):
-        future = Future()
+        future = _Future()
         coroutine = self._sink.make_coroutine(future)
-        return coroutine, (NamedFuture(self._name, future),)
+        return coroutine, (NamedFuture(self._name, future, self._combine),)
+
+    def batch_coroutine_and_outputs(self):
+        future = _Future()
+        coroutine = self._sink.make_batch_coroutine(future)
+        return coroutine, (NamedFuture(self._name, future, self._combine),)
+
+    def column_coroutine_and_outputs(self):
+        future = _Future()
+        coroutine = self._sink.make_column_coroutine(future)
+        return coroutine, (NamedFuture(self._name, future, self._combine),)
 
     class Name(_Component):
 
@@ -287,6 +926,12 @@ class _Return(_Component):
         def coroutine_and_outputs(self):
             return _Return(self.name, into_consumer()).coroutine_and_outputs()
 
+        def batch_coroutine_and_outputs(self):
+            return _Return(self.name, into_consumer()).batch_coroutine_and_outputs()
+
+        def column_coroutine_and_outputs(self):
+            return _Return(self.name, into_consumer()).column_coroutine_and_outputs()
+
         @classmethod
         def no_name_given(cls, sink=into(list), *args, **kwds):
             return cls('return')(sink, *args, **kwds)
@@ -298,6 +943,8 @@ class _MultipleNames:
         self.names = names
 
     def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
         return type(self)(*self.names, name)
 
 
@@ -307,42 +954,119 @@ class _On(_Component):
         self.name = name
 
     def __call__(self, *components):
-        return (getattr(get, self.name), components) >> getattr(put, self.name)
+        return (getattr(get, self.name), *components) >> getattr(put, self.name)
 
 
 class _Put (_Component, _MultipleNames):
 
     def __rrshift__(self, action):
-        self.pipe_fn = pipe(action).fn(tuple)
+        self._pipe = pipe(*action) if type(action) is tuple else pipe(action)
         return self
 
     __lshift__ = __rrshift__
 
-    def coroutine_and_outputs(self):
-
-        def attach_each_to_namespace(namespace, returned):
-            for name, value in zip(self.names, returned):
+    # The returned callable attaches the values returned by the action to the
+    # namespace (or record). It updates the namespace in place if it is `owned`
+    # (nothing else refers to it), and works on a copy otherwise.
+    def make_return(self):
+        names = self.names
+        name  = names[0]
+
+        def attach_each_to_namespace(namespace, returned, owned=False):
+            if isinstance(namespace, Record):
+                return namespace._updated(names, returned, owned)
+            if not owned:
+                namespace = shallow_copy(namespace)
+            for name, value in zip(names, returned):
                 setattr(namespace, name, value)
             return namespace
 
-        def attach_it_to_namespace(namespace, it):
-            setattr(namespace, self.names[0], it)
+        def attach_it_to_namespace(namespace, it, owned=False):
+            if isinstance(namespace, Record):
+                return namespace._updated(names, (it,), owned)
+            if not owned:
+                namespace = shallow_copy(namespace)
+            setattr(namespace, name, it)
             return namespace
 
-        if len(self.names) > 1: make_return = attach_each_to_namespace
-        else                  : make_return = attach_it_to_namespace
+        if len(self.names) > 1: return attach_each_to_namespace
+        else                  : return attach_it_to_namespace
+
+    def coroutine_and_outputs(self):
+        make_return = self.make_return()
+        pipe_fn = self._pipe.fn(tuple)
 
         @coroutine
         def put_loop(downstream):
             with closing(downstream):
                 while True:
-                    incoming_namespace, = (yield)
-                    returns = self.pipe_fn(incoming_namespace)
+                    incoming_namespace = yield
+                    returns = pipe_fn(incoming_namespace)
+                    if len(returns) == 1:
+                        owned = refcount(incoming_namespace) <= UNSHARED_ITEM
+                        downstream.send(make_return(incoming_namespace, returns[0], owned))
+                        continue
                     for returned in returns:
-                        outgoing_namespace = make_return(copy.copy(incoming_namespace), returned)
-                        downstream.send((outgoing_namespace,))
+                        downstream.send(make_return(incoming_namespace, returned))
         return put_loop, ()
 
+    def batch_coroutine_and_outputs(self):
+        make_return = self.make_return()
+        pipe_fn = self._pipe.fn(tuple)
+
+        @coroutine
+        def put_batch_loop(downstream):
+            with closing(downstream):
+                while True:
+                    batch = yield
+                    outgoing, ends = [], []
+                    try:
+                        for incoming_namespace in batch:
+                            returns = pipe_fn(incoming_namespace)
+                            if len(returns) == 1:
+                                owned = refcount(incoming_namespace) <= UNSHARED_IN_BATCH
+                                outgoing.append(make_return(incoming_namespace, returns[0], owned))
+                            else:
+                                for returned in returns:
+                                    outgoing.append(make_return(incoming_namespace, returned))
+                            ends.append(len(outgoing))
+                    except StopPipeline as stop:
+                        send_batch(downstream, outgoing, ends_origin(ends))
+                        raise stopped(stop, len(ends))
+                    send_batch(downstream, outgoing, ends_origin(ends))
+        return put_batch_loop, ()
+
+# Only CPython can tell whether anything else refers to an item. The thresholds
+# are the reference counts it reports for an item which nothing else refers to,
+# when received in the same way as by the put loops.
+def _unshared_refcounts():
+    def item_loop():
+        incoming_namespace = yield
+        yield refcount(incoming_namespace)
+    def batch_loop():
+        for incoming_namespace in (yield):
+            yield refcount(incoming_namespace)
+    item_loop, batch_loop = item_loop(), batch_loop()
+    next(item_loop)
+    next(batch_loop)
+    return item_loop.send(object()), batch_loop.send([object()])
+
+if sys.implementation.name == 'cpython':
+    refcount = sys.getrefcount
+    UNSHARED_ITEM, UNSHARED_IN_BATCH = _unshared_refcounts()
+else:
+    refcount = lambda it: 0
+    UNSHARED_ITEM = UNSHARED_IN_BATCH = -1
+
+
+def shallow_copy(namespace):
+    if type(namespace) is argparse.Namespace:
+        the_copy = argparse.Namespace.__new__(argparse.Namespace)
+        the_copy.__dict__.update(namespace.__dict__)
+        return the_copy
+    return copy.copy(namespace)
+
+
 DEBUG = False
 
 def debug(x):
@@ -353,6 +1077,8 @@ def debug(x):
 class _Get:
 
     def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
         return _Get.Attr(name)
 
     def __getitem__(self, key):
@@ -364,12 +1090,17 @@ class _Get:
             self.names = [name]
 
         def __getattr__(self, name):
+            if name.startswith('__'):
+                raise AttributeError(name)
             self.names.append(name)
             return self
 
         def __call__(self, it):
             return attrgetter(*self.names)(it)
 
+        def __repr__(self):
+            return f'get.{".".join(self.names)}'
+
         def __mul__(self, action):
             if len(self.names) == 1:
                 return (self,      action )
@@ -389,12 +1120,18 @@ class _Get:
         def __call__(self, it):
             return itemgetter(*self.keys)(it)
 
+        def __repr__(self):
+            return 'get' + ''.join(f'[{key!r}]' for key in self.keys)
+
 
 class _Item(_MultipleNames):
 
     def __call__(self, it):
         return itemgetter(*self.names)(it)
 
+    def __repr__(self):
+        return f'item.{".".join(self.names)}'
+
     __mul__ = _Get.Attr.__mul__
 
     __rmul__ = __mul__
@@ -406,7 +1143,97 @@ class _NAME(_MultipleNames):
         if len(self.names) != 1:
             items = items[0]
         assert len(self.names) == len(items)
-        return Namespace(**{n: i for (n,i) in zip(self.names, items)})
+        return argparse.Namespace(**{n: i for (n,i) in zip(self.names, items)})
+
+    def __repr__(self):
+        return f'name.{".".join(self.names)}'
+
+
+class _RECORD(_MultipleNames):
+
+    def __call__(self, *items):
+        if len(self.names) != 1:
+            items = items[0]
+        return record_type(*self.names)(*items)
+
+    def __repr__(self):
+        return f'record.{".".join(self.names)}'
+
+
+# Compact alternatives to Namespace: one __slots__ class per schema (tuple of
+# field names). `put` on a field outside the schema makes a record of the
+# extended schema; on a field inside it, updates in place if allowed.
+class Record:
+
+    __slots__ = ()
+    _fields   = ()
+
+    def _asdict(self):
+        return {field: getattr(self, field) for field in self._fields}
+
+    def __eq__(self, other):
+        if isinstance(other, Record            ): return self._asdict() == other._asdict()
+        if isinstance(other, argparse.Namespace): return self._asdict() == vars(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'record(' + ', '.join(f'{f}={v!r}' for f, v in self._asdict().items()) + ')'
+
+    def __copy__(self):
+        return type(self)(*map(self.__getattribute__, self._fields))
+
+    def __reduce__(self):
+        return _make_record, (self._fields, tuple(map(self.__getattribute__, self._fields)))
+
+    def _updated(self, names, values, owned):
+        return _record_updater(type(self), names)(self, values, owned)
+
+
+def _make_record(fields, values):
+    return record_type(*fields)(*values)
+
+
+@lru_cache(maxsize=None)
+def record_type(*fields):
+    if len(set(fields)) != len(fields):
+        raise ValueError(f'repeated field names in record{fields}')
+    if not all(map(str.isidentifier, fields)):
+        raise ValueError(f'record fields must be identifiers: {fields}')
+    namespace = {}
+    exec(f"""
+def __init__(self, {", ".join(fields)}):
+    {"; ".join(f"self.{f} = {f}" for f in fields) or "pass"}
+""", namespace)
+    return type('record', (Record,), dict(__slots__=fields, _fields=fields,
+                                          __init__=namespace['__init__']))
+
+
+@lru_cache(maxsize=None)
+def _record_updater(cls, names):
+    fields = cls._fields
+    values = [f'v_{name}' for name in names]
+    if set(names) <= set(fields):
+        source = f"""
+def update(r, values, owned):
+    {", ".join(values)}, = values
+    if not owned: r = r.__copy__()
+    {"; ".join(f"r.{name} = v_{name}" for name in names)}
+    return r
+"""
+    else:
+        extended = fields + tuple(name for name in dict.fromkeys(names) if name not in fields)
+        arguments = (f'v_{f}' if f in names else f'r.{f}' for f in extended)
+        source = f"""
+def update(r, values, owned):
+    {", ".join(values)}, = values
+    return Extended({", ".join(arguments)})
+"""
+        cls = record_type(*extended)
+    namespace = dict(Extended=cls)
+    exec(source, namespace)
+    return namespace['update']
 
 
 class _Name(_Component):
@@ -415,6 +1242,8 @@ class _Name(_Component):
         self.constructor = constructor
 
     def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
         return self.constructor(name)
 
     def __call__(self, *args, **kwds):
@@ -423,12 +1252,19 @@ class _Name(_Component):
     def coroutine_and_outputs(self):
         return self.constructor.no_name_given().coroutine_and_outputs()
 
+    def batch_coroutine_and_outputs(self):
+        return self.constructor.no_name_given().batch_coroutine_and_outputs()
+
+    def column_coroutine_and_outputs(self):
+        return self.constructor.no_name_given().column_coroutine_and_outputs()
+
 out  = _Name(_Return.Name)
 on   = _Name(_On)
 put  = _Name(_Put)
 get  = _Get()
 item = _Name(_Item)
 name = _Name(_NAME)
+record = _Name(_RECORD)
 
 
 class _Fold(_Component):
@@ -436,10 +1272,21 @@ class _Fold(_Component):
     # TODO: future-sinks should not appear at toplevel, as they must be wrapped
     # in an output. Detect and report error at conversion from implicit
 
-    def __init__(self, fn, initial=None, consumer=lambda x:x):
+    def __init__(self, fn, initial=None, consumer=None):
         self._fn = fn
         self._initial = initial
-        self._consumer = consumer
+        self._consumer = _identity if consumer is None else consumer
+
+    # How to merge the results of this fold over separate partitions
+    def combiner(self):
+        if self._fn is _append: return known_combiner(self._consumer)
+        return fold_combiner(self._fn, self._initial)
+
+    # The fold as (start, update, result) functions: see `aggregator`
+    def aggregator(self):
+        fn, initial = self._fn, self._initial
+        start = _identity if initial is None else (lambda value: fn(copy.copy(initial), value))
+        return start, fn, self._consumer
 
     def make_coroutine(self, future):
         binary_function = self._fn
@@ -447,19 +1294,60 @@ class _Fold(_Component):
         def fold_loop(future):
             if self._initial is None:
                 try:
-                    accumulator, = (yield)
+                    accumulator = yield
                 except StopIteration:
                     # TODO: message about not being able to run on an empty stream.
                     pass
             else:
-                accumulator = self._initial
+                accumulator = copy.copy(self._initial)
             try:
                 while True:
-                    accumulator = binary_function(accumulator, *(yield))
+                    accumulator = binary_function(accumulator, (yield))
             finally:
                 future.set_result(self._consumer(accumulator))
         return fold_loop(future)
 
+    def make_batch_coroutine(self, future):
+        binary_function = self._fn
+        @coroutine
+        def fold_batch_loop(future):
+            if self._initial is None:
+                batch = yield
+                accumulator, skip = batch[0], 1
+            else:
+                accumulator, skip, batch = copy.copy(self._initial), 0, ()
+            index = skip
+            try:
+                while True:
+                    for index, item in enumerate(it.islice(batch, skip, None), skip):
+                        accumulator = binary_function(accumulator, item)
+                    batch, skip = (yield), 0
+            except StopPipeline as stop:
+                raise stopped(stop, index)
+            finally:
+                future.set_result(self._consumer(accumulator))
+        return fold_batch_loop(future)
+
+    def make_column_coroutine(self, future):
+        reduce_column = _column_reductions.get(self._fn)
+        if reduce_column is None:
+            return as_lists(self.make_batch_coroutine(future))
+        @coroutine
+        def fold_column_loop(future):
+            if self._initial is None:
+                column = yield
+                accumulator = column[:1].tolist()[0]
+                if len(column) > 1:
+                    accumulator = reduce_column(accumulator, column[1:])
+            else:
+                accumulator = copy.copy(self._initial)
+            try:
+                while True:
+                    accumulator = reduce_column(accumulator, (yield))
+            finally:
+                future.set_result(self._consumer(accumulator))
+        return fold_column_loop(future)
+
 
 class Slice(_Component):
 
@@ -484,77 +1372,184 @@ class Slice(_Component):
         @coroutine
         def slice_loop(downstream):
             with closing(downstream):
+                if close_all:
+                    for _ in range(start)       : yield
+                    for _ in stopper:
+                        downstream.send((yield))
+                        for _ in range(step - 1): yield
+                    yield
+                    raise StopPipeline
+                if not stopper:
+                    yield
+                    raise _Finished
                 for _ in range(start)           : yield
-                for _ in stopper:
+                for n, _ in enumerate(stopper):
+                    if n:
+                        for _ in range(step - 1): yield
                     downstream.send((yield))
-                    for _ in range(step - 1)    : yield
-
-                yield
-
-                if close_all: raise StopPipeline
-                while True:
-                    yield
+                raise _Finished
         return slice_loop, ()
 
-
+    def batch_coroutine_and_outputs(self):
+        start, stop, step = attrgetter('start', 'stop', 'step')(self.spec)
+        close_all = self.close_all
+        # Position, in the whole stream, of the item which closes the slice
+        end = None if stop is None else start + len(self.stopper) * step
+        @coroutine
+        def slice_batch_loop(downstream):
+            with closing(downstream):
+                seen = 0
+                while end is None or seen < end:
+                    batch = yield
+                    first = max(start - seen, (step - (seen - start) % step) % step)
+                    last  = len(batch) if end is None else min(len(batch), end - seen)
+                    seen += len(batch)
+                    selected = batch[first:last:step]
+                    if len(selected): downstream.send(selected)
+                    if close_all and last < len(batch): raise stopped(StopPipeline(), last)
+                if end == 0: yield
+                if close_all:
+                    if end: yield
+                    raise stopped(StopPipeline(), 0)
+                raise _Finished
+        return slice_batch_loop, ()
+
+    column_coroutine_and_outputs = batch_coroutine_and_outputs
+
+
+# `arg` builds expression trees rather than closures: `arg.a > 3` records
+# attribute access and comparison nodes, which can be inspected, printed,
+# compiled into a single lambda, inlined by fusion and applied to whole arrays
+# in column mode. Calling any expression other than `arg` itself evaluates it.
 class _Arg:
 
+    __slots__ = '_op', '_operands', '_fn'
+
+    def __init__(self, op='arg', *operands):
+        self._op       = op
+        self._operands = operands
+        self._fn       = None
+
     @classmethod
     def install_binary_op(cls, op):
 
-        from operator import sub, floordiv, truediv
-        swap = sub, floordiv, truediv
-
-        # TODO: set __name__ etc
         def __op__(self, rhs):
-            def implementation(lhs):
-                return op(lhs, rhs)
-            return implementation
+            return cls('binary', op, self, rhs)
 
-        def swapped(self, rhs):
-            def implementation(lhs):
-                return op(rhs, lhs)
-            return implementation
+        def swapped(self, lhs):
+            return cls('binary', op, lhs, self)
 
-        setattr(cls,  f'__{op.__name__}__', __op__)
-        setattr(cls, f'__r{op.__name__}__', __op__ if op not in swap else swapped)
+        setattr(cls,  f'__{op.__name__.strip("_")}__', __op__)
+        setattr(cls, f'__r{op.__name__.strip("_")}__', swapped)
 
     @classmethod
     def install_unary_op(cls, op):
         def __op__(self):
-            def implementation(operand):
-                return op(operand)
-            return implementation
+            return cls('unary', op, self)
 
         setattr(cls,  f'__{op.__name__}__', __op__)
 
     def __getitem__(self, index_or_key):
-        return itemgetter(index_or_key)
+        return _Arg('item', self, index_or_key)
 
     def __getattr__(self, name):
-        return attrgetter(name)
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _Arg('attr', self, name)
 
     def __call__(self, *args, **kwds):
-        def implementation(fn):
-            return fn(*args, **kwds)
-        return implementation
+        if self._op == 'arg':
+            return _Arg('call', self, args, kwds)
+        return evaluator(self)(*args, **kwds)
+
+    def __repr__(self):
+        return expression_source(self, 'arg', constant=repr)
 
+    # The compiled function is not picklable, and is rebuilt on demand
+    def __reduce__(self):
+        return _Arg, (self._op, *self._operands)
 
-from operator import lt, gt, le, ge, eq, ne, add, sub, mul, floordiv, truediv
-for op in           (lt, gt, le, ge, eq, ne, add, sub, mul, floordiv, truediv):
+    __hash__ = object.__hash__
+
+
+from operator import lt, gt, le, ge, eq, ne, add, sub, mul, floordiv, truediv, mod, pow, and_, or_, xor
+for op in           (lt, gt, le, ge, eq, ne, add, sub, mul, floordiv, truediv, mod, pow, and_, or_, xor):
     _Arg.install_binary_op(op)
 
-from operator import neg, pos
-for op in           (neg, pos, abs):
+from operator import neg, pos, invert
+for op in           (neg, pos, abs, invert):
     _Arg.install_unary_op(op)
 
 arg = _Arg()
 
+_symbols = {lt: '<', gt: '>', le: '<=', ge: '>=', eq: '==', ne: '!=', add: '+', sub: '-',
+            mul: '*', floordiv: '//', truediv: '/', mod: '%', pow: '**', and_: '&',
+            or_: '|', xor: '^', neg: '-', pos: '+', invert: '~'}
+
+
+# Python source for `expr`, with `value` standing for the argument. Constants
+# are bound to fresh names in `namespace`, unless `constant` renders them.
+def expression_source(expr, value, namespace=None, prefix='c', constant=None):
+    if constant is None:
+        def constant(c):
+            name = f'{prefix}{len(namespace)}'
+            namespace[name] = c
+            return name
+
+    def source(node):
+        if not isinstance(node, _Arg):
+            return constant(node)
+        op, operands = node._op, node._operands
+        if op == 'arg'   : return value
+        if op == 'attr'  : return f'{source(operands[0])}.{operands[1]}'
+        if op == 'item'  : return f'{source(operands[0])}[{source(operands[1])}]'
+        if op == 'call'  :
+            fn, args, kwds = operands
+            return f'{source(fn)}({", ".join([*map(source, args), *(f"{k}={source(v)}" for k, v in kwds.items())])})'
+        if op == 'unary' :
+            fn, operand = operands
+            return f'abs({source(operand)})' if fn is abs else f'({_symbols[fn]}{source(operand)})'
+        fn, lhs, rhs = operands
+        return f'({source(lhs)} {_symbols[fn]} {source(rhs)})'
+
+    return source(expr)
+
+
+def compile_expression(expr):
+    namespace = {}
+    return eval(f'lambda x: {expression_source(expr, "x", namespace)}', namespace)
+
+
+# Expressions are compiled on first use. Anything else is its own evaluator.
+def evaluator(fn):
+    if not inlinable(fn):
+        return fn
+    if fn._fn is None:
+        fn._fn = compile_expression(fn)
+    return fn._fn
+
+
+def inlinable(fn):
+    return isinstance(fn, _Arg) and fn._op != 'arg'
+
+
+# Arithmetic and comparisons apply to whole arrays; attribute access, indexing
+# and calls do not.
+def elementwise(expr):
+    if not isinstance(expr, _Arg): return True
+    if expr._op == 'arg'         : return True
+    if expr._op == 'unary'       : return elementwise(expr._operands[1])
+    if expr._op == 'binary'      : return all(map(elementwise, expr._operands[1:]))
+    return False
+
 ######################################################################
 
 # Most component names don't have to be used explicitly, because plain python
 # types have implicit interpretations as components
 def decode_implicits(it):
+    return awaiting(decode_implicit_type(it))
+
+def decode_implicit_type(it):
     if isinstance(it, _Component): return it
     if isinstance(it, pipe      ): return it.pipe()
     if isinstance(it, list      ): return _Branch(*it)
@@ -564,15 +1559,289 @@ def decode_implicits(it):
     else                         : return _Map(it)
 
 
+# Linear runs of maps and filters are compiled into a single coroutine. Set to
+# False to get one coroutine per component, which can help when debugging.
+FUSE = True
+
+def fuse(components):
+    for fusible, run in it.groupby(components, lambda c: type(c) in (_Map, _Filter)):
+        run = tuple(run)
+        if fusible and len(run) > 1: yield _Fused(run)
+        else                       : yield from run
+
+
+class _Fused(_Component):
+
+    def __init__(self, stages):
+        self._stages = stages
+        self._loops = {}
+
+    def coroutine_and_outputs(self):
+        return coroutine(self._loop(batch=False)), ()
+
+    def batch_coroutine_and_outputs(self):
+        return coroutine(self._loop(batch=True)), ()
+
+    def column_coroutine_and_outputs(self):
+        stages = tuple((type(s) is _Map, *s._args, None)[:3] for s in self._stages)
+        if not all(vectorised(fn) and (key is None or vectorised(key)) for _, fn, key in stages):
+            return _Component.column_coroutine_and_outputs(self)
+        @coroutine
+        def fused_column_loop(downstream):
+            with closing(downstream):
+                while True:
+                    column = yield
+                    for is_map, fn, key in stages:
+                        if is_map: column = column_apply(fn, column)
+                        else     : column = column[column_mask(fn, column, key)]
+                    if len(column): downstream.send(column)
+        return fused_column_loop, ()
+
+    def _loop(self, batch):
+        if batch not in self._loops:
+            self._loops[batch] = self._compile(batch)
+        return self._loops[batch]
+
+    def _compile(self, batch):
+        namespace = dict(closing=closing, StopPipeline=StopPipeline,
+                         send_batch=send_batch, stopped=stopped)
+        shape = []
+        for n, stage in enumerate(self._stages):
+            fn, key = (*stage._args, None)[:2]
+            namespace[f'f{n}'], namespace[f'k{n}'] = fn, key
+            if   key is None     : key_source = None
+            elif not inlinable(key): key_source = True
+            else                 : key_source = expression_source(key, 'x', namespace, f'k{n}_')
+            fn_source = expression_source(fn, 'x' if key is None else 'y', namespace, f'f{n}_') if inlinable(fn) else None
+            shape.append((type(stage) is _Map, fn_source, key_source))
+        exec(_fused_code(tuple(shape), batch), namespace)
+        return namespace['fused_loop']
+
+
+# The value variable in inlined expression sources (not an attribute, nor
+# part of the name of a constant)
+_VALUE = r'(?<![.\w])x(?!\w)'
+
+@lru_cache(maxsize=None)
+def _fused_code(shape, batch):
+    # shape: one (is_map, fn_source, key_source) triple per stage. Sources are
+    # inlined `arg` expressions; None (or True for keys) means call f{n} (k{n})
+    # In item mode the maps after the last filter are composed into a single
+    # expression, whose result is sent without being held in a local variable:
+    # this leaves put free to update it in place.
+    tail = len(shape) if batch else max((n + 1 for n, (is_map, *_) in enumerate(shape) if not is_map), default=0)
+    steps = []
+    for n, (is_map, fn_source, key_source) in enumerate(shape[:tail]):
+        call = 'x'
+        if key_source is not None:
+            steps.append(f'y = {key_source if key_source is not True else f"k{n}(x)"}')
+            call = 'y'
+        test = fn_source or f'f{n}({call})'
+        if is_map: steps.append(f'x = {test}')
+        else     : steps.append(f'if not {test}: continue')
+    if not batch:
+        composed = 'x'
+        for n, (_, fn_source, _) in enumerate(shape[tail:], tail):
+            if fn_source is None:
+                composed = f'f{n}({composed})'
+            elif len(re.findall(_VALUE, fn_source)) == 1:
+                composed = re.sub(_VALUE, lambda _: composed, fn_source)
+            else: # the value appears more than once: compute it only once
+                if composed != 'x': steps.append(f'x = {composed}')
+                steps.append(f'x = {fn_source}')
+                composed = 'x'
+        steps.append(f'send({composed})')
+
+    filtering = not all(is_map for is_map, *_ in shape)
+    if batch:
+        indent = '\n' + ' ' * 20
+        source = f"""
+def fused_loop(downstream):
+    with closing(downstream):
+        while True:
+            batch = yield
+            out, origins, index = [], [], 0
+            try:
+                for index, x in enumerate(batch):
+                    {indent.join(steps)}
+                    out.append(x){'; origins.append(index)' if filtering else ''}
+            except StopPipeline as stop:
+                send_batch(downstream, out, {'origins.__getitem__' if filtering else 'int'})
+                raise stopped(stop, index)
+            x = None
+            send_batch(downstream, out, {'origins.__getitem__' if filtering else 'int'})
+"""
+    else:
+        indent = '\n' + ' ' * 12
+        source = f"""
+def fused_loop(downstream):
+    send = downstream.send
+    with closing(downstream):
+        while True:
+            x = yield
+            {indent.join(steps)}
+"""
+    return compile(source, '<liquidata fused>', 'exec')
+
+
 def push(source, pipe):
+    source = iter(source)
     for item in source:
         try:
-            pipe.send((item,))
+            pipe.send(item)
+        except StopPipeline:
+            break
+        except _Finished:
+            close_source(source)
+            break
+    pipe.close()
+
+
+def push_batches(source, pipe, size, convert=None):
+    batches, source = batches_of(source, size)
+    for batch in batches:
+        try:
+            pipe.send(batch if convert is None else convert(batch))
         except StopPipeline:
             break
+        except _Finished:
+            close_source(source)
+            break
     pipe.close()
 
 
+# File sources read and decode whole batches at a time. Also returns the
+# iterator which should be closed if the network finishes early.
+def batches_of(source, size):
+    if isinstance(source, FileSource):
+        batches = source.batches(size)
+        return batches, batches
+    source = iter(source)
+    return iter(lambda: list(it.islice(source, size)), []), source
+
+
+# Like push, but sends the next item only once everything which reached the
+# `ready` queue has been taken.
+def pull(items, network, ready, source):
+    try:
+        for item in items:
+            try:
+                network.send(item)
+            except StopPipeline:
+                break
+            except _Finished:
+                close_source(source)
+                break
+            while ready:
+                yield ready.popleft()
+        network.close()
+        while ready:
+            yield ready.popleft()
+    finally:
+        network.close()
+        close_source(source)
+
+
+# When every sink has finished, nothing more will be read from the source. If
+# it is a generator, let it clean up now.
+def close_source(source):
+    if isinstance(source, GeneratorType):
+        source.close()
+
+
+def forward_to(target):
+    while True:
+        target.send((yield))
+
+
+def push_columns(source, pipe, size):
+    push_batches(source, pipe, size, convert=column_of)
+
+
+def send_batch(downstream, batch, origin):
+    if not len(batch):
+        return
+    try:
+        downstream.send(batch)
+    except StopPipeline as stop:
+        raise stopped(stop, origin(stop.index))
+
+
+def stopped(stop, index):
+    stop.index = index
+    return stop
+
+
+def ends_origin(ends):
+    def origin(index):
+        return bisect_right(ends, index)
+    return origin
+
+
+def mask_origin(mask):
+    def origin(index):
+        return next(it.islice(it.compress(it.count(), mask), index, None))
+    return origin
+
+
+def unbatched(itemwise):
+    if hasattr(itemwise, 'close'):
+        @coroutine
+        def unbatched_sink_loop():
+            with closing(itemwise):
+                while True:
+                    batch = yield
+                    index = 0
+                    try:
+                        for index, item in enumerate(batch):
+                            itemwise.send(item)
+                    except StopPipeline as stop:
+                        raise stopped(stop, index)
+        return unbatched_sink_loop()
+
+    @coroutine
+    def unbatched_loop(downstream):
+        collector = _Collector(downstream)
+        loop = itemwise(collector)
+        with closing(loop):
+            while True:
+                batch = yield
+                collector.reset()
+                index = 0
+                try:
+                    for index, item in enumerate(batch):
+                        collector.origin = index
+                        loop.send(item)
+                except StopPipeline as stop:
+                    collector.flush()
+                    raise stopped(stop, index)
+                except _Finished:
+                    collector.flush()
+                    raise
+                collector.flush()
+    return unbatched_loop
+
+
+class _Collector:
+
+    def __init__(self, downstream):
+        self.downstream = downstream
+        self.reset()
+
+    def reset(self):
+        self.items, self.origins, self.origin = [], [], 0
+
+    def send(self, item):
+        self.items  .append(item)
+        self.origins.append(self.origin)
+
+    def flush(self):
+        send_batch(self.downstream, self.items, self.origins.__getitem__)
+
+    def close(self):
+        self.downstream.close()
+
+
 def combine_coroutines(coroutines):
     coroutines = tuple(coroutines)
     if not coroutines:
@@ -600,7 +1869,14 @@ def closing(target):
 
 ######################################################################
 
-class StopPipeline(Exception): pass
+class StopPipeline(Exception):
+    index = None
+
+# Raised by a component to its upstream, when it will not pass anything more
+# downstream. It spreads upstream until it reaches a branch with another live
+# side, or the source.
+class _Finished(Exception):
+    pass
 
 ######################################################################
 
@@ -613,37 +1889,431 @@ def until(predicate):
     def until_loop(downstream):
         with closing(downstream):
             while True:
-                args = yield
-                if predicate(*args):
+                item = yield
+                if predicate(item):
                     break
                 else:
-                    downstream.send(args)
-            while True:
-                yield
+                    downstream.send(item)
+        raise _Finished
     return until_loop
 
 
-def while_(predicate): return until(lambda x: not predicate(x))
-
-
-def into_consumer(consumer=list):
-    def append(the_list, element):
-        the_list.append(element)
-        return the_list
-    return _Fold(append, [], consumer)
-
+@batched(until)
+def until(predicate):
+    def until_batch_loop(downstream):
+        with closing(downstream):
+            while True:
+                batch = yield
+                index = 0
+                try:
+                    for index, item in enumerate(batch):
+                        if predicate(item):
+                            break
+                    else:
+                        index = None
+                except StopPipeline as stop:
+                    if index: downstream.send(batch[:index])
+                    raise stopped(stop, index)
+                if index is None:
+                    downstream.send(batch)
+                    continue
+                if index: downstream.send(batch[:index])
+                break
+        raise _Finished
+    return until_batch_loop
+
+
+def while_(predicate): return until(lambda x: not predicate(x))
+
+
+# Consumers which build a collection need every element anyway: collecting
+# into a list first costs no more. Those with an incremental form are updated
+# item by item, in constant space. Everything else is handed the collected
+# list, unless it asked to be fed lazily.
+_collectors = {list, tuple, set, frozenset, sorted}
+
+def into_consumer(consumer=list, lazy=False):
+    if consumer in _collectors:
+        return _Fold(_append, [], consumer)
+    if incremental_into(consumer):
+        return _Aggregate(consumer)
+    if lazy:
+        return _Into(consumer)
+    return _Fold(_append, [], consumer)
+
+
+# statistics.mean is left out: it is exact, whereas its incremental form is not
+def incremental_into(consumer):
+    return consumer in (len, sum, min, max)
+
+
+class _Aggregate(_Component):
+
+    def __init__(self, consumer):
+        self._consumer = consumer
+
+    def combiner(self):
+        return known_combiner(self._consumer)
+
+    def make_coroutine(self, future):
+        consumer, (start, update, result) = self._consumer, _incremental_aggregates[self._consumer]
+        @coroutine
+        def aggregate_loop(future):
+            accumulator = empty = object()
+            try:
+                accumulator = start((yield))
+                while True:
+                    accumulator = update(accumulator, (yield))
+            finally:
+                future.set_result(consumer(()) if accumulator is empty else result(accumulator))
+        return aggregate_loop(future)
+
+    def make_batch_coroutine(self, future):
+        consumer, (start, update, result) = self._consumer, _incremental_aggregates[self._consumer]
+        @coroutine
+        def aggregate_batch_loop(future):
+            accumulator = empty = object()
+            try:
+                batch = yield
+                accumulator = reduce(update, it.islice(batch, 1, None), start(batch[0]))
+                while True:
+                    accumulator = reduce(update, (yield), accumulator)
+            finally:
+                future.set_result(consumer(()) if accumulator is empty else result(accumulator))
+        return aggregate_batch_loop(future)
+
+    def make_column_coroutine(self, future):
+        return as_lists(self.make_batch_coroutine(future))
+
+def _append(the_list, element):
+    the_list.append(element)
+    return the_list
+
+
+class _Into(_Component):
+
+    CHUNK = 1024
+
+    def __init__(self, consumer):
+        self._consumer = consumer
+
+    def combiner(self):
+        return known_combiner(self._consumer)
+
+    def make_coroutine(self, future):
+        @coroutine
+        def into_loop(future):
+            feed, chunk = _Feed(self._consumer), []
+            try:
+                while True:
+                    chunk.append((yield))
+                    if len(chunk) == self.CHUNK:
+                        feed.put(chunk)
+                        chunk = []
+                        if feed.done: raise _Finished
+            finally:
+                feed.put(chunk)
+                future.set_result(feed.result())
+        return into_loop(future)
+
+    def make_batch_coroutine(self, future):
+        @coroutine
+        def into_batch_loop(future):
+            feed = _Feed(self._consumer)
+            try:
+                while True:
+                    feed.put((yield))
+                    if feed.done: raise _Finished
+            finally:
+                future.set_result(feed.result())
+        return into_batch_loop(future)
+
+    def make_column_coroutine(self, future):
+        return as_lists(self.make_batch_coroutine(future))
+
+
+# Runs a consumer of an iterable in a thread of its own (a daemon thread,
+# started on the first item), handing it chunks of items through a bounded
+# queue, so that only a few chunks exist at any time.
+class _Feed:
+
+    def __init__(self, consumer):
+        self._consumer = consumer
+        self._thread   = None
+        self._error    = None
+        self.done      = False # The consumer has returned (or failed)
+
+    def put(self, chunk):
+        if not chunk:
+            return
+        if self._thread is None:
+            self._start()
+        self._queue.put(chunk)
+
+    def _start(self):
+        from queue import Queue
+        self._queue  = Queue(maxsize=4)
+        self._thread = threading.Thread(target=self._consume, daemon=True)
+        self._thread.start()
+
+    def _consume(self):
+        chunks = iter(self._queue.get, None)
+        try:
+            self._result = self._consumer(it.chain.from_iterable(chunks))
+        except BaseException as error:
+            self._error = error
+        self.done = True
+        for _ in chunks: # The consumer may stop early: don't block the producer
+            pass
+
+    def result(self):
+        if self._thread is None:
+            return self._consumer(iter(()))
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+# Keyed folds keep one accumulator per key, in a dict. `fold` may be a binary
+# function (as in `out(fn)`); one of len, sum, min, max, list, set or
+# statistics.mean, which are accumulated incrementally; or a tuple or dict of
+# these, which computes several aggregates in a single pass. `value` selects
+# what is folded (by default the whole item).
+#
+# With `top=k`, memory is bounded: whenever 2k keys are held, all but the k
+# most frequent are dropped, and the result holds the k most frequent keys.
+# This is approximate: a key which is dropped and later seen again starts from
+# scratch.
+class _KeyedFold(_Component):
+
+    def __init__(self, by, fold=list, initial=None, value=None, top=None):
+        if top is not None and top <= 0: raise ValueError('top requires k > 0')
+        self._by, self._fold, self._initial, self._value, self._top = by, fold, initial, value, top
+
+    # Partitions' top-k results lack the counts needed to merge them
+    def combiner(self):
+        combine = None if self._top is not None else fold_combiner(self._fold, self._initial)
+        return combine and partial(_merge_keyed, combine)
+
+    def make_coroutine(self, future):
+        @coroutine
+        def keyed_fold_loop(future):
+            accumulators, accumulate, result = self.accumulators()
+            try:
+                while True:
+                    accumulate((yield))
+            finally:
+                future.set_result(self.results(accumulators, result))
+        return keyed_fold_loop(future)
+
+    def make_batch_coroutine(self, future):
+        @coroutine
+        def keyed_fold_batch_loop(future):
+            accumulators, accumulate, result = self.accumulators(batched=True)
+            try:
+                while True:
+                    accumulate((yield))
+            finally:
+                future.set_result(self.results(accumulators, result))
+        return keyed_fold_batch_loop(future)
+
+    def make_column_coroutine(self, future):
+        return as_lists(self.make_batch_coroutine(future))
+
+    # Returns the accumulators (a dict, and a dict of counts when top is
+    # given), a function which updates them with one item or, if `batched`,
+    # with a list of items, and the function which finishes each accumulator.
+    def accumulators(self, batched=False):
+        key, value, top = evaluator(self._by), evaluator(self._value), self._top
+        start, update, result = aggregator(self._fold, self._initial)
+        accumulators, counts = {}, {}
+        if self._fold is len and top is None and batched:
+            counter = Counter()
+            return (counter, None), lambda items: counter.update(map(key, items)), result
+        missing = object()
+        def accumulate(item):
+            this = key(item)
+            accumulator = accumulators.get(this, missing)
+            if value is not None:
+                item = value(item)
+            if accumulator is missing: accumulators[this] = start (             item)
+            else                     : accumulators[this] = update(accumulator, item)
+            if top is not None:
+                counts[this] = counts.get(this, 0) + 1
+                if len(counts) >= 2 * top:
+                    prune(accumulators, counts, top)
+        if batched:
+            def accumulate_all(items):
+                for item in items:
+                    accumulate(item)
+            return (accumulators, counts), accumulate_all, result
+        return (accumulators, counts), accumulate, result
+
+    def results(self, accumulators, result):
+        accumulators, counts = accumulators
+        if self._top is not None:
+            keys = heapq.nlargest(self._top, counts, key=counts.get)
+            return {key: result(accumulators[key]) for key in keys}
+        if result is _identity:
+            return dict(accumulators)
+        return {key: result(accumulator) for key, accumulator in accumulators.items()}
+
+
+def prune(accumulators, counts, top):
+    kept = {key: (accumulators[key], counts[key]) for key in heapq.nlargest(top, counts, key=counts.get)}
+    accumulators.clear()
+    counts      .clear()
+    for key, (accumulator, count) in kept.items():
+        accumulators[key] = accumulator
+        counts      [key] = count
+
+
+# Returns the (start, update, result) functions which fold values into an
+# accumulator: start(first_value), update(accumulator, value), result(accumulator).
+def aggregator(fold, initial=None):
+    if isinstance(fold, dict):
+        names = tuple(fold)
+        start, update, result = aggregator(tuple(fold.values()))
+        return start, update, lambda accumulators: argparse.Namespace(**dict(zip(names, result(accumulators))))
+    if isinstance(fold, tuple):
+        starts, updates, results = zip(*map(aggregator, fold))
+        def start(value):
+            return [fn(value) for fn in starts]
+        def update(accumulators, value):
+            for index, fn in enumerate(updates):
+                accumulators[index] = fn(accumulators[index], value)
+            return accumulators
+        def result(accumulators):
+            return tuple(fn(accumulator) for fn, accumulator in zip(results, accumulators))
+        return start, update, result
+    if isinstance(fold, _Fold):
+        return fold.aggregator()
+    incremental = incremental_aggregate(fold)
+    if incremental:
+        return incremental
+    if initial is None:
+        return _identity, fold, _identity
+    return (lambda value: fold(copy.copy(initial), value)), fold, _identity
+
+
+def incremental_aggregate(fold):
+    statistics = sys.modules.get('statistics')
+    if statistics and fold in (statistics.mean, statistics.fmean):
+        return _mean
+    try:
+        return _incremental_aggregates.get(fold)
+    except TypeError: # unhashable fold
+        return None
+
+
+def _identity(x):
+    return x
+
+def _add_to_set(the_set, element):
+    the_set.add(element)
+    return the_set
+
+def _mean_update(accumulator, value):
+    accumulator[0] += value
+    accumulator[1] += 1
+    return accumulator
+
+_mean = (lambda value: [value, 1]), _mean_update, (lambda accumulator: accumulator[0] / accumulator[1])
+
+_incremental_aggregates = {
+    len : ((lambda value:     1    ), (lambda n   , value: n + 1                         ), _identity),
+    sum : ((lambda value: 0 + value), add                                                 , _identity),
+    min : (_identity                , (lambda low , value: value if value < low  else low ), _identity),
+    max : (_identity                , (lambda high, value: value if value > high else high), _identity),
+    list: ((lambda value: [value]  ), _append                                             , _identity),
+    set : ((lambda value: {value}  ), _add_to_set                                         , _identity),
+}
+
+
+# Binary functions which merge the results of the same aggregate over separate
+# partitions of the input (see pipe.parallel)
+def _merge_sorted(left, right):
+    return list(heapq.merge(left, right))
+
+_combiners = {len: add, sum: add, min: min, max: max,
+              list: add, tuple: add, set: or_, frozenset: or_, sorted: _merge_sorted}
+
+def known_combiner(aggregate):
+    try:
+        return _combiners.get(aggregate)
+    except TypeError: # unhashable aggregate
+        return None
+
+# The combiner for the per-key results of `aggregator(fold, initial)`
+def fold_combiner(fold, initial=None):
+    if isinstance(fold, dict):
+        combine = fold_combiner(tuple(fold.values()))
+        return combine and partial(_combine_fields, combine)
+    if isinstance(fold, tuple):
+        combines = tuple(map(fold_combiner, fold))
+        return None if None in combines else partial(_combine_each, combines)
+    if isinstance(fold, _Fold):
+        return fold.combiner()
+    combine = known_combiner(fold)
+    if combine is None and initial is None and associative(fold):
+        return fold
+    return combine
+
+# Folds (without `initial`) whose results over separate partitions are merged
+# by the fold itself. Any other fold would give wrong answers silently (e.g.
+# sub), so it must be given combine=...
+_associative = {add, mul, and_, or_, xor, min, max}
+
+def associative(fn):
+    try:
+        return fn in _associative
+    except TypeError: # unhashable fold
+        return False
+
+def _combine_each(combines, left, right):
+    return tuple(combine(l, r) for combine, l, r in zip(combines, left, right))
+
+def _combine_fields(combine, left, right):
+    names = vars(left)
+    return argparse.Namespace(**dict(zip(names, combine(tuple(names.values()), tuple(vars(right).values())))))
+
+def _merge_keyed(combine, left, right):
+    merged = dict(left)
+    for key, value in right.items():
+        merged[key] = combine(merged[key], value) if key in merged else value
+    return merged
+
 
 def star(fn):
     fn = decode_implicits(fn)
     if isinstance(fn, _Map):
         fn = fn._args[0]
-    if isinstance(fn, (flat, _Filter)):
+    if isinstance(fn, (flat, _Filter, _Pipe, _Concurrent)):
         return fn.star()
     return _star(fn)
 
+# The components of a pipe, with the first function on each path through them
+# unpacking its argument tuple. The tuple is passed unchanged through slices,
+# stage boundaries and branches; other components cannot take it apart.
+def starred(components):
+    if not components:
+        return ()
+    first, *rest = components
+    first = decode_implicits(first)
+    if isinstance(first, (Slice, stage_boundary)):
+        return (first, *starred(rest))
+    if isinstance(first, _Branch):
+        return (_Branch(*starred(first._pipe._components)), *starred(rest))
+    if isinstance(first, (_Map, _Filter, flat, sink, until, _Pipe, _Concurrent)):
+        return (first.star(), *rest)
+    raise TypeError(f'{describe(first)} cannot unpack the arguments of a pipe.fn() called with several')
+
 def _star(fn):
     def star(args):
         return fn(*args)
+    star.__wrapped__ = fn
     return star
 
 # TODO: this was quickly added for use in the tutorial. It requires careful
@@ -654,11 +2324,1518 @@ def use(fn, *args, **kwds):
         return fn(arg1, *args, **kwds)
     return use
 
+######################################################################
+#    Grouping and windows                                            #
+######################################################################
+
+# Grouping components hold only the group or window which is still open, and
+# send each one downstream as soon as it closes. Whatever is still open when
+# the stream ends is sent before the downstream is closed.
+#
+# Subclasses provide `grouper()`, which returns a pair of functions: `feed`
+# takes one item and returns the groups which it closed; `finish` returns the
+# groups which remain open at the end.
+
+class _Grouping(_Component):
+
+    def coroutine_and_outputs(self):
+        @coroutine
+        def grouping_loop(downstream):
+            feed, finish = self.grouper()
+            with closing(downstream):
+                try:
+                    while True:
+                        for group in feed((yield)):
+                            downstream.send(group)
+                except GeneratorExit:
+                    for group in finish():
+                        if not send_remaining(downstream, group):
+                            break
+        return grouping_loop, ()
+
+    def batch_coroutine_and_outputs(self):
+        @coroutine
+        def grouping_batch_loop(downstream):
+            feed, finish = self.grouper()
+            with closing(downstream):
+                try:
+                    while True:
+                        batch = yield
+                        groups, origins = [], []
+                        for index, item in enumerate(batch):
+                            closed = feed(item)
+                            if closed:
+                                groups .extend(closed)
+                                origins.extend((index,) * len(closed))
+                        send_batch(downstream, groups, origins.__getitem__)
+                except GeneratorExit:
+                    remaining = list(finish())
+                    if remaining: send_remaining(downstream, remaining)
+        return grouping_batch_loop, ()
+
+
+# Returns whether the downstream is still accepting items
+def send_remaining(downstream, item):
+    try:
+        downstream.send(item)
+        return True
+    except (StopPipeline, _Finished):
+        return False
+
+
+# Runs of consecutive items with equal keys, as (key, [items]) pairs
+class group_by(_Grouping):
+
+    def __init__(self, key=None):
+        self._args = (key,)
+        self.key = key
+
+    def grouper(self):
+        key, group, current = _identity if self.key is None else evaluator(self.key), [], None
+        def feed(item):
+            nonlocal group, current
+            this = key(item)
+            if group and this != current:
+                closed = ((current, group),)
+                group, current = [item], this
+                return closed
+            group.append(item)
+            current = this
+            return ()
+        def finish():
+            return ((current, group),) if group else ()
+        return feed, finish
+
+
+# Tuples of `n` consecutive items, starting every `step` items: step=1 slides
+# by one item, step=n gives tumbling windows and step>n skips items between
+# windows. Incomplete windows at the end of the stream are not sent.
+class window(_Grouping):
+
+    def __init__(self, n, step=1):
+        if n    <= 0: raise ValueError('window requires n > 0')
+        if step <= 0: raise ValueError('window requires step > 0')
+        self._args = n, step
+        self.n, self.step = n, step
+
+    def grouper(self):
+        step, ring, due = self.step, deque(maxlen=self.n), self.n
+        def feed(item):
+            nonlocal due
+            ring.append(item)
+            due -= 1
+            if due:
+                return ()
+            due = step
+            return (tuple(ring),)
+        def finish():
+            return ()
+        return feed, finish
+
+
+# Windows of `span` time units, driven by the (non-decreasing) numeric
+# timestamps which `key` extracts from each item. Windows start at multiples
+# of `step`: by default step=span, which gives tumbling windows; a smaller
+# step gives overlapping ones. Each window which contains any items is sent
+# as a (start, (items...)) pair, once an item beyond its end arrives.
+class time_window(_Grouping):
+
+    def __init__(self, span, key, step=None):
+        if step is None: step = span
+        if span <= 0: raise ValueError('time_window requires span > 0')
+        if step <= 0: raise ValueError('time_window requires step > 0')
+        self._args = span, key, step
+        self.span, self.key, self.step = span, key, step
+
+    def grouper(self):
+        span, key, step = self.span, evaluator(self.key), self.step
+        ring  = deque() # (timestamp, item) pairs in the open windows
+        first = None    # index of the earliest open window
+        latest = None
+        def earliest_window(t):
+            return math.floor((t - span) / step) + 1
+        def close_first():
+            nonlocal first
+            start = first * step
+            closed = start, tuple(item for _, item in ring)
+            first += 1
+            while ring and ring[0][0] < first * step:
+                ring.popleft()
+            return closed
+        def feed(item):
+            nonlocal first, latest
+            t = key(item)
+            if latest is not None and t < latest:
+                raise ValueError(f'time_window received timestamp {t!r} after {latest!r}')
+            latest = t
+            if first is None:
+                first = earliest_window(t)
+            closed = []
+            while ring and t >= first * step + span:
+                closed.append(close_first())
+            if not ring:
+                first = max(first, earliest_window(t))
+            if t >= first * step:
+                ring.append((t, item))
+            return closed
+        def finish():
+            closed = []
+            while ring:
+                closed.append(close_first())
+            return closed
+        return feed, finish
+
+
+# Lists of `n` consecutive items; the last one may be shorter
+class batch(_Grouping):
+
+    def __init__(self, n):
+        if n <= 0: raise ValueError('batch requires n > 0')
+        self._args = n,
+        self.n = n
+
+    def grouper(self):
+        n, chunk = self.n, []
+        def feed(item):
+            nonlocal chunk
+            chunk.append(item)
+            if len(chunk) < n:
+                return ()
+            closed, chunk = (chunk,), []
+            return closed
+        def finish():
+            return (chunk,) if chunk else ()
+        return feed, finish
+
+    # Whole batches are sliced into chunks, rather than fed item by item
+    def batch_coroutine_and_outputs(self):
+        n = self.n
+        @coroutine
+        def chunk_batch_loop(downstream):
+            pending = []
+            with closing(downstream):
+                try:
+                    while True:
+                        batch = yield
+                        carried = len(pending)
+                        pending.extend(batch)
+                        full = len(pending) - len(pending) % n
+                        chunks = [pending[start : start + n] for start in range(0, full, n)]
+                        send_batch(downstream, chunks, lambda index: (index + 1) * n - 1 - carried)
+                        pending = pending[full:]
+                except GeneratorExit:
+                    if pending: send_remaining(downstream, [pending])
+        return chunk_batch_loop, ()
+
+######################################################################
+#    Deduplication                                                   #
+######################################################################
+
+# Deduplicating components are filters whose predicate remembers the keys it
+# has passed. Subclasses provide `predicate()`, which is called afresh each
+# time the network is built, so separate runs do not share memories.
+
+class _Dedup(_Component):
+
+    def filter(self):
+        return _Filter(self.predicate(), self._key)
+
+    def coroutine_and_outputs       (self): return self.filter().coroutine_and_outputs()
+    def batch_coroutine_and_outputs (self): return self.filter().batch_coroutine_and_outputs()
+    def column_coroutine_and_outputs(self): return self.filter().column_coroutine_and_outputs()
+
+
+# Items whose keys have not been seen before. With `maxsize` only that many of
+# the most recently seen keys are remembered; with `ttl` a key is forgotten
+# once `ttl` seconds (as told by `clock`) pass without it being seen again.
+class distinct(_Dedup):
+
+    def __init__(self, key=None, maxsize=None, ttl=None, clock=time.monotonic):
+        if maxsize is not None and maxsize < 1: raise ValueError('distinct requires maxsize >= 1')
+        if ttl     is not None and ttl    <= 0: raise ValueError('distinct requires ttl > 0')
+        self._args = key,
+        self._key, self._maxsize, self._ttl, self._clock = key, maxsize, ttl, clock
+
+    def predicate(self):
+        maxsize, ttl, clock = self._maxsize, self._ttl, self._clock
+        if maxsize is None and ttl is None:
+            seen = set()
+            def unseen(key):
+                size = len(seen)
+                seen.add(key)
+                return len(seen) > size
+            return unseen
+        seen = OrderedDict() # key -> when it was last seen, least recent first
+        def unseen(key):
+            now = None
+            if ttl is not None:
+                now = clock()
+                while seen:
+                    oldest, then = next(iter(seen.items()))
+                    if now - then < ttl: break
+                    del seen[oldest]
+            new = key not in seen
+            seen[key] = now
+            if new:
+                if maxsize is not None and len(seen) > maxsize:
+                    seen.popitem(last=False)
+            else:
+                seen.move_to_end(key)
+            return new
+        return unseen
+
+
+def unique_by(key, **kwds): return distinct(key, **kwds)
+
+
+# Items whose keys are probably new: a Bloom filter sized for `capacity`
+# distinct keys. Repeats are always removed; up to `capacity` keys, about a
+# proportion `error` of new ones are mistaken for repeats, and removed too.
+class probably_unseen(_Dedup):
+
+    def __init__(self, capacity, error=0.01, key=None):
+        if capacity < 1        : raise ValueError('probably_unseen requires capacity >= 1')
+        if not 0 < error < 1   : raise ValueError('probably_unseen requires 0 < error < 1')
+        self._args = key,
+        self._key, self._capacity, self._error = key, capacity, error
+
+    def predicate(self):
+        size   = max(8, math.ceil(-self._capacity * math.log(self._error) / math.log(2) ** 2))
+        hashes = max(1, round(size / self._capacity * math.log(2)))
+        bits   = bytearray((size + 7) // 8)
+        def unseen(key):
+            h = _hash64(key)
+            first, step = h & 0xffffffff, h >> 32 | 1
+            new = False
+            for index in range(first, first + hashes * step, step):
+                index %= size
+                byte, bit = index >> 3, 1 << (index & 7)
+                if not bits[byte] & bit:
+                    bits[byte] |= bit
+                    new = True
+            return new
+        return unseen
+
+
+# An estimate of the number of distinct items, in constant space: a
+# HyperLogLog sketch whose relative standard error is about `error`. Use
+# `out.X(distinct_count)`, or `out.X(distinct_count(error=...))` to tune it.
+class _DistinctCount(_Fold):
+
+    def __init__(self, error=0.01):
+        if not 0 < error < 1: raise ValueError('distinct_count requires 0 < error < 1')
+        precision = min(18, max(4, math.ceil(math.log2((1.04 / error) ** 2))))
+        super().__init__(partial(_sketch_add, precision), bytearray(1 << precision), _sketch_estimate)
+
+    def __call__(self, error=0.01):
+        return type(self)(error)
+
+
+def _sketch_add(precision, registers, item):
+    h = _hash64(item)
+    rest = h & ((1 << 64 - precision) - 1)
+    rank = 64 - precision - rest.bit_length() + 1
+    index = h >> 64 - precision
+    if rank > registers[index]:
+        registers[index] = rank
+    return registers
+
+
+def _sketch_estimate(registers):
+    m = len(registers)
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+    estimate = alpha * m * m / sum(2.0 ** -r for r in registers)
+    empty = registers.count(0)
+    if estimate <= 2.5 * m and empty:
+        estimate = m * math.log(m / empty)
+    return round(estimate)
+
+
+# `hash` scrambled (by the splitmix64 finaliser) so that all of its 64 bits
+# vary: hashes of small ints are the ints themselves. Ints (and the floats
+# equal to them) use their own value instead: `hash` maps -1 and -2, and ints
+# which differ by 2**61 - 1, to the same value. Ints wider than 64 bits use
+# a digest of their bytes.
+def _hash64(item):
+    if type(item) is float and item.is_integer():
+        item = int(item)
+    if not isinstance(item, int):
+        h = hash(item) & 0xffffffffffffffff
+    elif -1 << 63 <= item < 1 << 63:
+        h = item & 0xffffffffffffffff
+    else:
+        from hashlib import blake2b
+        digest = blake2b(item.to_bytes(item.bit_length() // 8 + 1, 'little', signed=True), digest_size=8)
+        h = int.from_bytes(digest.digest(), 'little')
+    h = (h ^ h >> 30) * 0xbf58476d1ce4e5b9 & 0xffffffffffffffff
+    h = (h ^ h >> 27) * 0x94d049bb133111eb & 0xffffffffffffffff
+    return h ^ h >> 31
+
+
+distinct_count = _DistinctCount()
+
+######################################################################
+#    Files                                                           #
+######################################################################
+
+# File sources are plain iterables, so they can be passed to a pipe, to
+# `source` or to `>> source`. They read in large blocks and, in batch and
+# column mode, hand whole decoded batches to the pipe. File sinks write in
+# blocks. Files whose names end in .gz, .bz2 or .xz are (de)compressed.
+
+BUFFER_SIZE = 1 << 20
+
+def open_file(path, mode, **kwds):
+    path = os.fspath(path)
+    if path.endswith('.gz' ): import gzip; return gzip.open(path, mode, **kwds)
+    if path.endswith('.bz2'): import bz2 ; return bz2 .open(path, mode, **kwds)
+    if path.endswith('.xz' ): import lzma; return lzma.open(path, mode, **kwds)
+    return open(path, mode, buffering=BUFFER_SIZE, **kwds)
+
+
+def compressed(path):
+    return os.fspath(path).endswith(('.gz', '.bz2', '.xz'))
+
+
+class FileSource:
+
+    BATCH = 1024
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path     = path
+        self.encoding = encoding
+
+    def __iter__(self):
+        batches = self.batches(self.BATCH)
+        try:
+            for batch in batches:
+                yield from batch
+        finally:
+            batches.close()
+
+    def open(self, **kwds):
+        return open_file(self.path, 'rt', encoding=self.encoding, **kwds)
+
+
+# Lines of text, without their line endings
+class lines(FileSource):
+
+    def batches(self, size):
+        with self.open() as file:
+            pending = ''
+            while True:
+                block = file.read(BUFFER_SIZE)
+                if not block:
+                    break
+                batch = (pending + block).split('\n')
+                pending = batch.pop()
+                for start in range(0, len(batch), size):
+                    yield batch[start : start + size]
+            if pending:
+                yield [pending]
+
+
+# Rows as lists of strings or, with header=True, as dicts keyed by the header
+class csv_rows(FileSource):
+
+    def __init__(self, path, header=False, encoding='utf-8', **format):
+        super().__init__(path, encoding)
+        self.header = header
+        self.format = format
+
+    def batches(self, size):
+        import csv
+        with self.open(newline='') as file:
+            rows = (csv.DictReader if self.header else csv.reader)(file, **self.format)
+            yield from iter(lambda: list(it.islice(rows, size)), [])
+
+
+# One JSON value per line; blank lines are skipped
+class json_lines(FileSource):
+
+    def batches(self, size):
+        import json
+        decode = json.JSONDecoder().decode
+        with self.open() as file:
+            for batch in iter(lambda: list(it.islice(file, size)), []):
+                batch = [decode(line) for line in batch if not line.isspace()]
+                if batch:
+                    yield batch
+
+
+# Fixed-size binary records, unpacked into tuples according to a `struct`
+# format. Uncompressed files are memory-mapped rather than read.
+class binary_records(FileSource):
+
+    def __init__(self, path, format):
+        import struct
+        super().__init__(path, None)
+        self.struct = struct.Struct(format)
+
+    def __reduce__(self):
+        return binary_records, (self.path, self.struct.format)
+
+    def batches(self, size):
+        if compressed(self.path): return self._read_batches(size)
+        else                    : return self._mapped_batches(size)
+
+    def _mapped_batches(self, size):
+        import mmap
+        with open(os.fspath(self.path), 'rb') as file:
+            length = os.fstat(file.fileno()).st_size
+            self._check(length)
+            if not length:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                records = self.struct.iter_unpack(mapped)
+                try:
+                    yield from iter(lambda: list(it.islice(records, size)), [])
+                finally:
+                    del records # release the mapping before it is closed
+
+    def _read_batches(self, size):
+        with open_file(self.path, 'rb') as file:
+            for block in iter(partial(file.read, size * self.struct.size), b''):
+                self._check(len(block))
+                yield list(self.struct.iter_unpack(block))
+
+    def _check(self, length):
+        if length % self.struct.size:
+            raise ValueError(f'{os.fspath(self.path)} does not hold a whole number '
+                             f'of {self.struct.size}-byte records')
+
+
+class FileSink(_Component):
+
+    BLOCK = 1024
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path     = path
+        self.encoding = encoding
+
+    def open(self, **kwds):
+        return open_file(self.path, 'wt', encoding=self.encoding, **kwds)
+
+    def coroutine_and_outputs(self):
+        @coroutine
+        def write_loop():
+            with self.open_writer() as write:
+                block = []
+                try:
+                    while True:
+                        block.append((yield))
+                        if len(block) == self.BLOCK:
+                            write(block)
+                            block = []
+                finally:
+                    if block: write(block)
+        return write_loop(), ()
+
+    def batch_coroutine_and_outputs(self):
+        @coroutine
+        def write_batch_loop():
+            with self.open_writer() as write:
+                while True:
+                    batch = yield
+                    if batch: write(batch)
+        return write_batch_loop(), ()
+
+    @contextmanager
+    def open_writer(self):
+        with self.open() as file:
+            yield self.writer(file)
+
+
+class write_lines(FileSink):
+
+    def writer(self, file):
+        def write(items):
+            file.write('\n'.join(map(str, items)) + '\n')
+        return write
+
+
+# Rows are sequences or, if `fields` are given, dicts (written with a header)
+class write_csv(FileSink):
+
+    def __init__(self, path, fields=None, encoding='utf-8', **format):
+        super().__init__(path, encoding)
+        self.fields = fields
+        self.format = format
+
+    def open(self):
+        return super().open(newline='')
+
+    def writer(self, file):
+        import csv
+        if self.fields is None:
+            return csv.writer(file, **self.format).writerows
+        writer = csv.DictWriter(file, self.fields, **self.format)
+        writer.writeheader()
+        return writer.writerows
+
+
+class write_json_lines(FileSink):
+
+    def writer(self, file):
+        import json
+        encode = json.JSONEncoder().encode
+        def write(items):
+            file.write(''.join([encode(item) + '\n' for item in items]))
+        return write
+
+######################################################################
+#    Concurrent components                                           #
+######################################################################
+
+# Networks built for pipe.fn() must produce all the outputs of each call before
+# the call returns, so concurrent components fall back to running inline.
+class _FunctionBuild(threading.local):
+
+    depth = 0
+
+    def __enter__(self):
+        self.depth += 1
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+
+building_function = _FunctionBuild()
+
+
+class _Concurrent(_Component):
+
+    def __init__(self, fn, workers=None, chunksize=1, window=None, ordered=True, _starred=False):
+        if chunksize < 1: raise ValueError('chunksize must be >= 1')
+        self._flat = isinstance(fn, flat)
+        if self._flat: fn, = fn._args
+        self._fn        = _star(fn) if _starred else fn
+        self._workers   = workers or self.default_workers()
+        self._chunksize = chunksize
+        self._window    = window or 2 * self._workers
+        self._ordered   = ordered
+        self._settings  = dict(workers=workers, chunksize=chunksize, window=window, ordered=ordered)
+
+    # The name, in concurrent.futures (imported on first use), of the class of
+    # executor which runs the tasks
+    EXECUTOR = None
+
+    def _executor(self):
+        from concurrent import futures
+        return getattr(futures, self.EXECUTOR)(self._workers)
+
+    def _inline(self):
+        return (flat if self._flat else _Map)(self._fn)
+
+    def star(self):
+        fn = flat(self._fn) if self._flat else self._fn
+        return type(self)(fn, **self._settings, _starred=True)
+
+    def coroutine_and_outputs(self):
+        if building_function.depth:
+            return self._inline().coroutine_and_outputs()
+        work = partial(_apply_chunk, self._fn, self._flat)
+        chunksize, flatten = self._chunksize, self._flat
+
+        @coroutine
+        def concurrent_loop(downstream):
+            chunk = []
+            with closing(downstream), _InFlight(self._executor(), self._window, self._ordered) as in_flight:
+                def emit(completed):
+                    for results in completed:
+                        for result in (it.chain.from_iterable(results) if flatten else results):
+                            downstream.send(result)
+                try:
+                    while True:
+                        chunk.append((yield))
+                        if len(chunk) == chunksize:
+                            emit(in_flight.submit(work, chunk))
+                            chunk = []
+                except GeneratorExit:
+                    if chunk:
+                        in_flight.submit_nowait(work, chunk)
+                    try:
+                        emit(in_flight.drain())
+                    except (StopPipeline, _Finished):
+                        pass
+        return concurrent_loop, ()
+
+    # Each batch is completed before the next one is accepted, and its results
+    # are always passed on in their original order.
+    def batch_coroutine_and_outputs(self):
+        if building_function.depth:
+            return self._inline().batch_coroutine_and_outputs()
+        call = partial(_call, self._fn, self._flat)
+        chunksize, flatten = self._chunksize, self._flat
+
+        @coroutine
+        def concurrent_batch_loop(downstream):
+            with closing(downstream), self._executor() as executor:
+                while True:
+                    batch = yield
+                    results = []
+                    try:
+                        results.extend(executor.map(call, batch, chunksize=chunksize))
+                    except StopPipeline as stop:
+                        if flatten: send_flattened(downstream, results)
+                        elif results: downstream.send(results)
+                        raise stopped(stop, len(results))
+                    if flatten: send_flattened(downstream, results)
+                    else      : downstream.send(results)
+        return concurrent_batch_loop, ()
+
+    @staticmethod
+    def default_workers():
+        return os.cpu_count() or 1
+
+
+def send_flattened(downstream, results):
+    flattened, ends = [], []
+    for result in results:
+        flattened.extend(result)
+        ends.append(len(flattened))
+    send_batch(downstream, flattened, ends_origin(ends))
+
+
+# Functions passed to `parallel` are sent to worker processes, so they must be
+# picklable: lambdas and closures will not do.
+class parallel(_Concurrent):
+
+    EXECUTOR = 'ProcessPoolExecutor'
+
+
+# For I/O-bound functions, or ones which release the GIL
+class threaded(_Concurrent):
+
+    EXECUTOR = 'ThreadPoolExecutor'
+
+    @staticmethod
+    def default_workers():
+        return min(32, (os.cpu_count() or 1) + 4)
+
+
+def _apply_chunk(fn, flatten, chunk):
+    return [_call(fn, flatten, item) for item in chunk]
+
+
+def _call(fn, flatten, item):
+    try:
+        return list(fn(item)) if flatten else fn(item)
+    except Exception as exception:
+        # Identify the failing item: the traceback shows only the worker
+        if hasattr(exception, 'add_note'):
+            exception.add_note(f'while applying {fn!r} to {reprlib.repr(item)}')
+        raise
+
+
+class _InFlight:
+
+    def __init__(self, executor, window, ordered):
+        self._executor = executor
+        self._window   = window
+        self._ordered  = ordered
+        self._pending  = deque()
+
+    def submit(self, *task):
+        self.submit_nowait(*task)
+        if len(self._pending) >= self._window:
+            return self._completed()
+        return ()
+
+    def submit_nowait(self, *task):
+        self._pending.append(self._executor.submit(*task))
+
+    def _completed(self):
+        from concurrent.futures import wait, FIRST_COMPLETED
+        pending = self._pending
+        if self._ordered:
+            yield pending.popleft().result()
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+        else:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                yield future.result()
+
+    def drain(self):
+        while self._pending:
+            yield from self._completed()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for future in self._pending:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+
+
+# Everything downstream of a stage_boundary runs in a thread of its own, fed
+# through a queue of at most `maxsize` chunks of `chunk` items (in batch mode,
+# each batch is a chunk). So upstream stages, including the source, can run
+# ahead of downstream ones, overlapping I/O and GIL-releasing work on either
+# side. Exceptions raised downstream are re-raised upstream on the next send
+# (or when the stream ends); when the pipeline is stopped, any items still
+# queued are discarded. Inside pipe.fn() the boundary does nothing.
+class stage_boundary(_Component):
+
+    def __init__(self, maxsize=16, chunk=64):
+        if maxsize < 1: raise ValueError('maxsize must be >= 1')
+        if chunk   < 1: raise ValueError('chunk must be >= 1')
+        self._maxsize = maxsize
+        self._chunk   = chunk
+
+    def coroutine_and_outputs(self):
+        if building_function.depth:
+            return _Map(_identity).coroutine_and_outputs()
+        maxsize, chunksize = self._maxsize, self._chunk
+
+        @coroutine
+        def boundary_loop(downstream):
+            chunk = []
+            with _Segment(downstream, maxsize, _send_each) as segment:
+                try:
+                    while True:
+                        chunk.append((yield))
+                        if len(chunk) == chunksize:
+                            segment.put(chunk)
+                            chunk = []
+                except GeneratorExit:
+                    segment.flush(chunk)
+        return boundary_loop, ()
+
+    # A stop from downstream arrives after upstream has moved on, so none of
+    # the batch being sent counts as having passed the boundary.
+    def batch_coroutine_and_outputs(self):
+        if building_function.depth:
+            return _Map(_identity).batch_coroutine_and_outputs()
+        maxsize = self._maxsize
+
+        @coroutine
+        def boundary_batch_loop(downstream):
+            with _Segment(downstream, maxsize, _send_whole) as segment:
+                try:
+                    while True:
+                        batch = yield
+                        try:
+                            segment.put(batch)
+                        except StopPipeline as stop:
+                            raise stopped(stop, 0)
+                except GeneratorExit:
+                    pass
+        return boundary_batch_loop, ()
+
+    column_coroutine_and_outputs = batch_coroutine_and_outputs
+
+
+def _send_each(downstream, chunk):
+    for item in chunk:
+        downstream.send(item)
+
+def _send_whole(downstream, batch):
+    downstream.send(batch)
+
+
+class _Segment:
+
+    def __init__(self, downstream, maxsize, send):
+        from queue import Queue
+        self._queue  = Queue(maxsize=maxsize)
+        self._error  = None
+        self._thread = threading.Thread(target=self._run, args=(downstream, send), daemon=True)
+        self._thread.start()
+
+    END = object()
+
+    def _run(self, downstream, send):
+        chunks = self._chunks()
+        try:
+            with closing(downstream):
+                for chunk in chunks:
+                    send(downstream, chunk)
+        except BaseException as error:
+            self._error = error
+        for _ in chunks: # Don't block the upstream thread
+            pass
+
+    # Not iter(get, END): that compares chunks (which may be arrays) with ==
+    def _chunks(self):
+        get = self._queue.get
+        while True:
+            chunk = get()
+            if chunk is self.END:
+                return
+            yield chunk
+
+    def put(self, chunk):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(chunk)
+
+    def flush(self, chunk):
+        if chunk and self._error is None:
+            self._queue.put(chunk)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._queue.put(self.END)
+        self._thread.join()
+        error = self._error
+        if exc_type is None and error is not None and not isinstance(error, (StopPipeline, _Finished)):
+            raise error
+
+######################################################################
+#    Asynchronous components                                         #
+######################################################################
+
+def awaiting(component):
+    kind = type(component)
+    if kind in (_Map, _Filter) and code_flags(component._args[0]) & CO_COROUTINE      : return _Awaited(kind, *component._args)
+    if kind is flat            and code_flags(component._args[0]) & CO_ASYNC_GENERATOR: return _Awaited(kind, *component._args)
+    return component
+
+
+# Unlike inspect.iscoroutinefunction, never touches attributes of arbitrary
+# callables: `get.a` and friends respond to any attribute lookup.
+def code_flags(fn):
+    if isinstance(fn, MethodType  ): fn = fn.__func__
+    if isinstance(fn, FunctionType): return fn.__code__.co_flags
+    return 0
+
+
+class _Awaited(_Component):
+
+    def __init__(self, kind, fn, key=None):
+        self._kind = kind
+        self._fn   = fn
+        self._key  = key
+
+    def coroutine_and_outputs(self):
+        context = async_build.context
+        if context is None or building_function.depth:
+            raise AsyncUnsupported(f'{self._fn} is asynchronous, so it can only be used in a pipe '
+                                   'which is called (and awaited) directly: not in nested pipes, '
+                                   'put actions, pipe.fn() or pipe.iter()')
+        @coroutine
+        def awaited_loop(downstream):
+            stage = _AwaitedStage(self._kind, self._fn, self._key, context.limit, downstream)
+            context.stages.append(stage)
+            with closing(downstream):
+                try:
+                    while True:
+                        stage.accept((yield))
+                finally:
+                    stage.cancel()
+        return awaited_loop, ()
+
+    def batch_coroutine_and_outputs(self):
+        raise AsyncUnsupported(f'{self._fn} is asynchronous: async pipes cannot run in batch mode')
+
+
+class _AwaitedStage:
+
+    def __init__(self, kind, fn, key, limit, downstream):
+        self.kind       = kind
+        self.fn         = fn
+        self.key        = key
+        self.limit      = limit
+        self.downstream = downstream
+        self.in_flight  = deque()
+
+    def accept(self, item):
+        from asyncio import ensure_future
+        self.in_flight.append((item, ensure_future(self.work(item))))
+
+    async def work(self, item):
+        fn, kind, key = self.fn, self.kind, self.key
+        if kind is flat   : return [result async for result in fn(item)]
+        if key is not None: return await fn(key(item))
+        else              : return await fn(item)
+
+    def saturated(self):
+        return len(self.in_flight) >= self.limit
+
+    def tasks(self):
+        return [task for _, task in self.in_flight]
+
+    def emit_ready(self):
+        in_flight, send = self.in_flight, self.downstream.send
+        emitted = False
+        while in_flight and in_flight[0][1].done():
+            item, task = in_flight.popleft()
+            result, emitted = task.result(), True
+            if   self.kind is _Map   : send(result)
+            elif self.kind is _Filter:
+                if result            : send(item)
+            else:
+                for each in result   : send(each)
+        return emitted
+
+    def cancel(self):
+        for task in self.tasks():
+            task.cancel()
+
+
+class _AsyncBuild(threading.local):
+    context = None
+
+async_build = _AsyncBuild()
+
+
+# Asynchronous stages are collected while the network is being built. The
+# driver awaits their in-flight work between items, and passes on the results
+# in the original order.
+class _AsyncContext:
+
+    def __init__(self, limit):
+        self.limit  = limit
+        self.stages = []
+
+    def __enter__(self):
+        self.outer, async_build.context = async_build.context, self
+        return self
+
+    def __exit__(self, *exc_info):
+        async_build.context = self.outer
+
+    async def run(self, source, network, collect_returns):
+        try:
+            if hasattr(source, '__aiter__'):
+                async for item in source:
+                    network.send(item)
+                    await self.settle(self.saturated)
+            else:
+                for item in source:
+                    network.send(item)
+                    await self.settle(self.saturated)
+            await self.settle(self.busy)
+        except StopPipeline:
+            pass
+        except _Finished:
+            if isinstance(source, AsyncGeneratorType): await source.aclose()
+            else                 : close_source(source)
+        finally:
+            for stage in self.stages:
+                stage.cancel()
+            network.close()
+        return collect_returns()
+
+    def saturated(self): return any(stage.saturated() for stage in self.stages)
+    def busy     (self): return any(stage.in_flight   for stage in self.stages)
+
+    async def settle(self, unsettled):
+        from asyncio import wait, FIRST_COMPLETED
+        self.pump()
+        while unsettled():
+            await wait([task for stage in self.stages for task in stage.tasks()],
+                       return_when=FIRST_COMPLETED)
+            self.pump()
+
+    def pump(self):
+        progress = True
+        while progress:
+            progress = False
+            for stage in self.stages:
+                progress |= stage.emit_ready()
+
+######################################################################
+#    Column mode                                                     #
+######################################################################
+
+# In column mode (pipe(..., columns=N)) the source is cut into NumPy arrays of
+# length N. Maps and filters made of `arg` expressions or NumPy ufuncs are
+# applied to whole arrays; add, max and min folds reduce whole arrays. All
+# other functions see plain Python values. Results match item mode: wherever
+# NumPy would differ (overflow, division by zero, bool arithmetic, ...) the
+# column is evaluated again item by item.
+
+def vectorised(fn):
+    if isinstance(fn, _Arg): return inlinable(fn) and elementwise(fn)
+    return type(fn).__name__ == 'ufunc'
+
+
+# Where Python raises (e.g. ZeroDivisionError), or overflows differently,
+# NumPy returns inf or nan with a warning, wraps integers around silently, or
+# raises something else. Columns on which that happens are evaluated again
+# item by item, which gives exactly what item mode gives.
+def column_apply(fn, column):
+    import numpy as np
+    try:
+        with np.errstate(divide='raise', over='raise', invalid='raise'):
+            if isinstance(fn, _Arg):
+                return column_evaluate(fn, column)
+            return fn(column)
+    except Exception:
+        return column_of([fn(x) for x in column.tolist()])
+
+
+# Evaluates a vectorised `arg` expression one operation at a time, so that
+# each can be checked before NumPy gets a chance to wrap around.
+def column_evaluate(expr, column):
+    import numpy as np
+    if not isinstance(expr, _Arg): return expr
+    if expr._op == 'arg'         : return column
+    fn, *operands = expr._operands
+    values = [column_evaluate(operand, column) for operand in operands]
+    if fn in _int_arithmetic:
+        # Arithmetic on Python bools gives ints (~True is -2, not False)
+        values = [value.astype(np.int64) if isinstance(value, np.ndarray) and value.dtype == bool else value
+                  for value in values]
+    check_exact(fn, values)
+    return fn(*values)
+
+_int_arithmetic = {add, sub, mul, floordiv, truediv, mod, pow, neg, pos, abs, invert}
+
+
+# Raises OverflowError unless NumPy computes `fn(*values)` exactly as Python
+# would: int64 results must stay within range (bound-checked from the largest
+# magnitudes of the operands, as _column_sum does), and ints meeting floats
+# must convert to float exactly.
+def check_exact(fn, values):
+    import numpy as np
+    kinds = [value.dtype.kind if isinstance(value, np.ndarray) else
+             'i' if isinstance(value, int) else
+             'f' if isinstance(value, float) else 'O'
+             for value in values]
+    if 'O' in kinds: return
+    if 'u' in kinds: raise OverflowError
+    sizes = [magnitude(value) for value, kind in zip(values, kinds) if kind in 'ib']
+    if 'f' in kinds or fn is truediv:
+        if max(sizes, default=0) > 2**53: raise OverflowError
+        return
+    limit = 2**63
+    if   fn in (neg, abs, floordiv): exact = sizes[0] < limit
+    elif fn in (add, sub)          : exact = sizes[0] + sizes[1] < limit
+    elif fn is mul                 : exact = sizes[0] * sizes[1] < limit
+    elif fn is pow                 :
+        exponent = values[1]
+        negative = exponent < 0 if isinstance(exponent, int) else len(exponent) and exponent.min() < 0
+        exact = not negative and (sizes[0] <= 1 or sizes[0].bit_length() * sizes[1] < 64)
+    else                           : exact = True
+    if not exact: raise OverflowError
+
+
+def magnitude(value):
+    if isinstance(value, int): return abs(value)
+    if not len(value)        : return 0
+    return max(-int(value.min()), int(value.max()))
+
+
+# Filters keep the items for which the predicate's value is truthy, whatever
+# its type: its values are never used as indices.
+def column_mask(predicate, column, key=None):
+    import numpy as np
+    if key is not None:
+        column = column_apply(key, column)
+    return np.asarray(column_apply(predicate, column), dtype=bool)
+
+
+# Only homogeneous ints, floats or bools get a numeric dtype: anything else
+# would change the values (e.g. ints in a mixed list would become floats).
+def column_of(values):
+    import numpy as np
+    if len(set(map(type, values))) == 1 and type(values[0]) in (int, float, bool):
+        try:
+            column = np.array(values, dtype=np.int64 if type(values[0]) is int else None)
+        except OverflowError:
+            column = None
+        if column is not None and column.ndim == 1:
+            return column
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def as_lists(batchwise):
+    if hasattr(batchwise, 'close'):
+        @coroutine
+        def listing_sink_loop():
+            with closing(batchwise):
+                while True:
+                    batchwise.send((yield).tolist())
+        return listing_sink_loop()
+
+    @coroutine
+    def listing_loop(downstream):
+        inner = batchwise(_Columns(downstream))
+        with closing(inner):
+            while True:
+                inner.send((yield).tolist())
+    return listing_loop
+
+
+class _Columns:
+
+    def __init__(self, downstream):
+        self.downstream = downstream
+
+    def send(self, batch):
+        self.downstream.send(column_of(batch))
+
+    def close(self):
+        self.downstream.close()
+
+
+def _column_sum(accumulator, column):
+    import numpy as np
+    kind = column.dtype.kind
+    if kind in 'biu' and type(accumulator) is int:
+        low, high = int(column.min()), int(column.max())
+        if max(-low, high) * len(column) < 2**63:
+            return accumulator + int(np.add.reduce(column, dtype=np.int64))
+    if column.dtype == np.float64 and type(accumulator) in (int, float):
+        # accumulate, unlike reduce, adds in the same order as a Python loop
+        return np.add.accumulate(np.concatenate(([accumulator], column)))[-1].item()
+    return reduce(add, column.tolist(), accumulator)
+
+
+def _column_extreme(ufunc_name, builtin):
+    def reduce_column(accumulator, column):
+        import numpy as np
+        kind = column.dtype.kind
+        if kind in 'biu' or kind == 'f' and not np.isnan(column).any():
+            return builtin(accumulator, getattr(np, ufunc_name).reduce(column).item())
+        return reduce(builtin, column.tolist(), accumulator)
+    return reduce_column
+
+
+def _column_extend(accumulator, column):
+    accumulator.extend(column.tolist())
+    return accumulator
+
+
+_column_reductions = {add    : _column_sum,
+                      max    : _column_extreme('maximum', max),
+                      min    : _column_extreme('minimum', min),
+                      _append: _column_extend}
+
+######################################################################
+#    Graphs                                                          #
+######################################################################
+
+# The structure of a pipe's network, found without building it: one node per
+# (unfused) decoded component. Branches, dispatch cases, nested pipes and put
+# actions hang off their nodes as graphs of their own. Where the network
+# would end a pipe or branch with an implicit `out`, so does the graph, with a
+# node marked `implicit`.
+class Graph:
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    @classmethod
+    def of(cls, the_pipe, capped=True):
+        components = the_pipe.decoded_components(fused=False)
+        nodes = [GraphNode.of(component) for component in components]
+        if capped and not (components and is_cap(components[-1])):
+            nodes.append(GraphNode('out', 'out', output='return', cap=True, implicit=True))
+        return cls(nodes)
+
+    def outputs(self):
+        names = []
+        for node in self.nodes:
+            if node.output is not None: names.append(node.output)
+            for _, branch in node.collected_branches():
+                names.extend(branch.outputs())
+        return names
+
+    # Descriptions of everything which would make the network misbehave:
+    # outputs whose names clash (other than anonymous ones, which are all
+    # returned), stages placed after an output or sink, branches (and dispatch
+    # cases) without an output or sink of their own, whose items would be
+    # returned anonymously, and outputs in nested pipes or put actions, which
+    # cannot return anything.
+    def problems(self):
+        problems = []
+        for name, count in Counter(self.outputs()).items():
+            if name != 'return' and count > 1:
+                problems.append(f'out.{name} is used {count} times')
+        def check(graph, where, nested):
+            for n, node in enumerate(graph.nodes):
+                if node.cap and n + 1 < len(graph.nodes):
+                    unreachable = ', '.join(later.label for later in graph.nodes[n+1:] if not later.implicit)
+                    if unreachable: problems.append(f'{where}: {unreachable} unreachable after {node.label}')
+                if nested and node.output is not None:
+                    problems.append(f'{where}: {node.label} is inside a nested pipe')
+                for label, branch in node.branches:
+                    inner = f'{where} > {node.label}' + (f' {label}' if label else '')
+                    collected = node.kind in GraphNode.COLLECTING
+                    if collected and branch.nodes[-1].implicit:
+                        problems.append(f'{inner}: no output or sink at end of branch')
+                    check(branch, inner, nested or not collected)
+        check(self, 'pipe', False)
+        return problems
+
+    def as_dict(self):
+        return dict(nodes=[node.as_dict() for node in self.nodes])
+
+    def to_json(self, **kwds):
+        import json
+        return json.dumps(self.as_dict(), **kwds)
+
+    # Graphviz source: each pipe runs left to right, with its branches (and
+    # other sub-graphs) attached to their nodes by dotted edges.
+    def to_dot(self):
+        import json
+        lines, ids = ['digraph pipe {', '    rankdir=LR;'], it.count()
+        def add(graph):
+            first = previous = None
+            for node in graph.nodes:
+                this  = f'n{next(ids)}'
+                shape = 'box' if node.cap else 'diamond' if node.kind == 'filter' else 'ellipse'
+                style = ', style=dashed' if node.implicit else ''
+                lines.append(f'    {this} [label={json.dumps(node.label)}, shape={shape}{style}];')
+                if previous:
+                    lines.append(f'    {previous} -> {this};')
+                for label, branch in node.branches:
+                    head = add(branch)
+                    if head:
+                        attrs = f'label={json.dumps(label)}, ' if label else ''
+                        lines.append(f'    {this} -> {head} [{attrs}style=dotted];')
+                first, previous = first or this, this
+            return first
+        add(self)
+        lines.append('}')
+        return '\n'.join(lines)
+
+
+class GraphNode:
+
+    # Kinds whose sub-graphs are branches of the network, rather than pipes
+    # run separately on each item (whose outputs cannot be returned)
+    COLLECTING = {'branch', 'dispatch'}
+
+    def __init__(self, kind, label, fn=None, starred=False, output=None, cap=False, implicit=False, branches=()):
+        self.kind     = kind
+        self.label    = label
+        self.fn       = fn
+        self.starred  = starred
+        self.output   = output
+        self.cap      = cap
+        self.implicit = implicit
+        self.branches = list(branches)
+
+    @classmethod
+    def of(cls, component):
+        attrs = vars(component)
+        kind  = type(component).__name__.strip('_').lower()
+        fn    = attrs['_args'][0] if attrs.get('_args') else attrs.get('_fn', attrs.get('_key'))
+        output = output_name(component)
+        if output is not None:
+            kind = 'out'
+        return cls(kind, describe(component),
+                   fn       = None if fn is None else describe_fn(fn),
+                   starred  = attrs.get('_starred', False) or hasattr_wrapped(fn),
+                   output   = output,
+                   cap      = is_cap(component),
+                   branches = sub_graphs(component))
+
+    def collected_branches(self):
+        return self.branches if self.kind in self.COLLECTING else ()
+
+    def as_dict(self):
+        return dict(kind=self.kind, label=self.label, fn=self.fn, starred=self.starred, output=self.output,
+                    cap=self.cap, implicit=self.implicit,
+                    branches=[dict(label=label, graph=graph.as_dict()) for label, graph in self.branches])
+
+    def __repr__(self):
+        return f'GraphNode({self.label})'
+
+
+def sub_graphs(component):
+    if isinstance(component, _Branch):
+        return [('', Graph.of(component._pipe))]
+    if isinstance(component, dispatch):
+        cases = [(f'case {value!r}', Graph.of(case)) for value, case in component._cases.items()]
+        if component._default is not None:
+            cases.append(('default', Graph.of(component._default)))
+        return cases
+    if isinstance(component, _Pipe):
+        return [('', Graph.of(component._pipe, capped=False))]
+    if isinstance(component, _Put) and '_pipe' in vars(component):
+        return [('action', Graph.of(component._pipe, capped=False))]
+    return []
+
+
+def output_name(component):
+    if isinstance(component, _Return     ): return component._name
+    if isinstance(component, _Return.Name): return component.name
+    if isinstance(component, _Name) and component.constructor is _Return.Name: return 'return'
+    return None
+
+
+def is_cap(component):
+    return isinstance(component, (sink, FileSink)) or output_name(component) is not None
+
+
+def hasattr_wrapped(fn):
+    return isinstance(fn, FunctionType) and '__wrapped__' in vars(fn)
+
+######################################################################
+#    Profiling                                                       #
+######################################################################
+
+# While a profile is active, the first network built (and any networks built
+# for branches, nested pipes and `put` actions while building it) is made of
+# unfused components, each wrapped in a probe which counts the items it is
+# sent and the time spent inside it. A stage's self time excludes the time
+# spent in the stages it feeds: the next stage and the heads of its branches.
+
+class _Profiling(threading.local):
+    current = None
+
+profiling = _Profiling()
+
+
+class _Probe:
+
+    __slots__ = 'target', 'stage', 'count'
+
+    def __init__(self, target, stage, count):
+        self.target = target
+        self.stage  = stage
+        self.count  = count
+
+    def send(self, value):
+        stage = self.stage
+        stage.items_in += self.count(value)
+        start = time.perf_counter()
+        try:     self.target.send(value)
+        finally: stage.time += time.perf_counter() - start
+
+    def close(self):
+        start = time.perf_counter()
+        try:     self.target.close()
+        finally: self.stage.time += time.perf_counter() - start
+
+
+class ProfiledStage:
+
+    def __init__(self, name):
+        self.name      = name
+        self.items_in  = 0
+        self.time      = 0.0
+        self.next      = None
+        self.branches  = []
+
+    @property
+    def items_out(self):
+        return None if self.next is None else self.next.items_in
+
+    @property
+    def ratio(self):
+        out = self.items_out
+        return None if out is None or not self.items_in else out / self.items_in
+
+    @property
+    def self_time(self):
+        fed = [self.next] if self.next else []
+        fed.extend(branch[0] for branch in self.branches if branch)
+        return max(0.0, self.time - sum(stage.time for stage in fed))
+
+    def as_dict(self):
+        return dict(name=self.name, items_in=self.items_in, items_out=self.items_out,
+                    ratio=self.ratio, time=self.time, self_time=self.self_time,
+                    branches=[[stage.as_dict() for stage in branch] for branch in self.branches])
+
+
+class Profile:
+
+    def __init__(self):
+        self.stages   = []
+        self.result   = None
+        self.building = None
+
+    def __enter__(self):
+        self.outer, profiling.current = profiling.current, self
+        return self
+
+    def __exit__(self, *exc_info):
+        profiling.current = self.outer
+        self.building = None
+
+    def wants_network(self):
+        return not self.stages or self.building is not None
+
+    def instrument(self, build, components, items):
+        count = _count_one if items else len
+        stages, outer = [], self.building
+        if outer is None: self.stages = stages
+        else            : outer.branches.append(stages)
+        cor_out_pairs = []
+        for component in components:
+            stage = self.building = ProfiledStage(describe(component))
+            if stages: stages[-1].next = stage
+            stages.append(stage)
+            coroutine, outputs = build(component)
+            cor_out_pairs.append((_probed(coroutine, stage, count), outputs))
+        self.building = outer
+        return tuple(cor_out_pairs)
+
+    @property
+    def time(self):
+        return self.stages[0].time if self.stages else 0.0
+
+    def as_dict(self):
+        return dict(time=self.time, stages=[stage.as_dict() for stage in self.stages])
+
+    def table(self):
+        lines = [f'{"stage":<40}{"in":>12}{"out":>12}{"ratio":>10}{"cumul ms":>12}{"self ms":>12}']
+        def add(stages, depth):
+            for stage in stages:
+                out   = '' if stage.items_out is None else stage.items_out
+                ratio = '' if stage.ratio     is None else f'{stage.ratio:.2f}'
+                name  = ('  ' * depth + stage.name)[:39]
+                lines.append(f'{name:<40}{stage.items_in:>12}{out:>12}{ratio:>10}'
+                             f'{stage.time * 1e3:12.3f}{stage.self_time * 1e3:12.3f}')
+                for branch in stage.branches:
+                    add(branch, depth + 1)
+        add(self.stages, 0)
+        return '\n'.join(lines)
+
+    __str__ = table
+
+
+
+def _count_one(args):
+    return 1
+
+
+def _probed(coroutine, stage, count):
+    if hasattr(coroutine, 'send'):
+        return _Probe(coroutine, stage, count)
+    return lambda downstream: _Probe(coroutine(downstream), stage, count)
+
+
+# Components' __getattr__ often has side effects, so look only at their vars.
+def describe(component):
+    attrs = vars(component)
+    kind  = type(component).__name__.strip('_')
+    if '_args'  in attrs: return f'{kind}({", ".join(map(describe_fn, filter(lambda a: a is not None, attrs["_args"])))})'
+    if '_fn'    in attrs: return f'{kind}({describe_fn(attrs["_fn"])})'
+    if '_name'  in attrs: return f'out.{attrs["_name"]}'
+    if 'name'   in attrs: return f'out.{attrs["name"]}'
+    if 'names'  in attrs: return f'put.{".".join(attrs["names"])}'
+    if attrs.get('constructor') is _Return.Name: return 'out'
+    return kind
+
+
+def describe_fn(fn):
+    if hasattr_wrapped(fn): return f'star({describe_fn(fn.__wrapped__)})'
+    if isinstance(fn, (FunctionType, MethodType, BuiltinFunctionType, type)): return fn.__qualname__
+    return reprlib.repr(fn)
+
 ######################################################################
 
 class LiquiDataException(Exception): pass
 class SinkMissing            (LiquiDataException): pass
 class NeedAtLeastOneCoroutine(LiquiDataException): pass
+class AsyncUnsupported       (LiquiDataException): pass
+class ResultMissing          (LiquiDataException): pass
+class CombinerMissing        (LiquiDataException): pass
+class InvalidPipe            (LiquiDataException): pass
 
 ######################################################################
 
@@ -674,4 +3851,22 @@ class Many(tuple):
 
 Void = Many()
 
-NamedFuture = namedtuple('NamedFuture', 'name, future')
+# `combine` merges the output's results from separate partitions (see pipe.parallel)
+NamedFuture = namedtuple('NamedFuture', 'name, future, combine')
+NamedFuture.__new__.__defaults__ = (None,)
+
+
+# asyncio.Future cannot be created without an event loop, which is not
+# available after asyncio.run has finished.
+class _Future:
+
+    __slots__ = '_result',
+
+    def set_result(self, result):
+        self._result = result
+
+    def result(self):
+        try:
+            return self._result
+        except AttributeError:
+            raise ResultMissing('no value was produced for this output') from None
@@ -0,0 +1,515 @@
+from timeit import repeat
+
+from operator import add
+from argparse import Namespace, ArgumentParser
+
+import fnmatch
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+from liquidata import pipe, out, flat, join, sink, on, get, put, take, drop, name, record, arg as _
+from liquidata import lines, write_lines, group_by, window, batch, dispatch, stage_boundary
+from liquidata import distinct, probably_unseen, distinct_count
+
+######################################################################
+#    Networks to be timed                                            #
+######################################################################
+
+def square(n): return n * n
+def odd   (n): return n % 2
+
+
+networks = dict(
+    maps     = lambda **kwds: pipe(square, _ + 1, _ * 2                      , **kwds),
+    filters  = lambda **kwds: pipe({odd}, square, {_ > 1000}                 , **kwds),
+    branches = lambda **kwds: pipe([{odd}, out.odd], [square, out.sq], out.id, **kwds),
+    fold     = lambda **kwds: pipe(square, out(lambda a, b: a + b)           , **kwds),
+    flat     = lambda **kwds: pipe(flat(lambda n: (n, n)), {odd}             , **kwds),
+)
+
+
+def best_of(stmt, number=1, repeats=5):
+    return min(repeat(stmt, number=number, repeat=repeats))
+
+
+def bench_batch(n=200_000, batches=(None, 64, 1024, 4096)):
+    data = range(n)
+    print(f'{"network":>10}' + ''.join(f'{str(b):>12}' for b in batches))
+    for name, make in networks.items():
+        times = []
+        for batch in batches:
+            network = make(batch=batch)
+            times.append(best_of(lambda: network(data)))
+        print(f'{name:>10}' + ''.join(f'{t:12.4f}' for t in times))
+
+
+def bench_call_overhead(calls=2_000, sizes=(1, 10, 100)):
+    print(f'{"network":>10}{"":>12}' + ''.join(f'{f"{n} items":>12}' for n in sizes) + '   (us/call)')
+    for name, make in networks.items():
+        network = make()
+        for label, call in (('rebuilt', lambda data: make()(data)),
+                            ('reused' , lambda data: network(data))):
+            times = [best_of(lambda: call(range(n)), number=calls) / calls * 1e6 for n in sizes]
+            print(f'{name:>10}{label:>12}' + ''.join(f'{t:12.1f}' for t in times))
+
+
+column_networks = dict(
+    arithmetic = lambda **kwds: pipe(_ * 3, _ + 1, {_ > 1000}    , **kwds),
+    sum        = lambda **kwds: pipe({_ > 100}, out(add)          , **kwds),
+    branches   = lambda **kwds: pipe([{_ > 5}, out.a(max)], out.b(add), **kwds),
+)
+
+
+def bench_columns(n=200_000, size=4096):
+    modes = dict(item={}, batch=dict(batch=size), columns=dict(columns=size))
+    print(f'{"network":>10}' + ''.join(f'{mode:>12}' for mode in modes))
+    data = list(range(n))
+    for name, make in column_networks.items():
+        times = [best_of(lambda: make(**kwds)(data)) for kwds in modes.values()]
+        print(f'{name:>10}' + ''.join(f'{t:12.4f}' for t in times))
+
+# Peak memory traced while pushing items through chains of unfused stages. It
+# comes from building the network and does not grow with the number of items.
+# (Stages used to wrap every item in a 1-tuple, but CPython serves those from
+# a free list, so tracemalloc never saw them: their cost shows up as time, in
+# the map, flat and branch benchmarks of the regression suite.)
+def bench_allocations(n=20_000, lengths=(1, 4, 16)):
+    import tracemalloc
+    print(f'{"network":>10}' + ''.join(f'{f"{length} stages":>12}' for length in lengths) + '   (peak bytes)')
+    for label, stage in (('flat', flat(one)), ('branch', [sink(noop)])):
+        peaks = []
+        for length in lengths:
+            network = pipe(*[stage] * length, sink(noop))
+            network(range(10))
+            tracemalloc.start()
+            network(range(n))
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        print(f'{label:>10}' + ''.join(f'{peak:12}' for peak in peaks))
+
+# The slowest modules imported by `import liquidata` in a fresh interpreter,
+# by cumulative import time, as reported by python -X importtime.
+def bench_import(shown=8):
+    python('-c', 'import liquidata')
+    times = {}
+    for line in python('-X', 'importtime', '-c', 'import liquidata').stderr.splitlines()[1:]:
+        _, cumulative, module = line.split('|')
+        times[module.strip()] = int(cumulative)
+    print(f'{"module":<28}{"us":>12}')
+    for module in sorted(times, key=times.get, reverse=True)[:shown]:
+        print(f'{module:<28}{times[module]:12}')
+
+
+# Runs a fresh interpreter in the directory holding liquidata. Bytecode is
+# cached even if PYTHONDONTWRITEBYTECODE is set, as otherwise compiling
+# liquidata would dwarf the time taken to import it.
+def python(*args):
+    environment = {k: v for k, v in os.environ.items() if k != 'PYTHONDONTWRITEBYTECODE'}
+    return subprocess.run([sys.executable, *args], env=environment, capture_output=True, text=True,
+                          check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+######################################################################
+#    Regression suite                                                #
+######################################################################
+
+# Each benchmark is a function which sets up its data and network, and returns
+# the thunk to be timed. Results are reported in nanoseconds per source item,
+# so that benchmarks of different sizes can be compared with one another and
+# with the plain-Python equivalents (named `python.*`).
+
+N = 20_000
+
+benchmarks = {}
+
+def benchmark(name):
+    def register(setup):
+        benchmarks[name] = setup
+        return setup
+    return register
+
+
+def noop(x): pass
+def inc (x): return x + 1
+def true(x): return True
+def one (x): return (x,)
+
+
+@benchmark('push')
+def setup():
+    network = pipe(sink(noop))
+    return lambda: network(range(N))
+
+@benchmark('python.push')
+def setup():
+    return lambda: [noop(x) for x in range(N)]
+
+
+for length in (1, 4, 16):
+
+    @benchmark(f'map.{length}')
+    def setup(length=length):
+        network = pipe(*[inc] * length, sink(noop))
+        return lambda: network(range(N))
+
+    @benchmark(f'python.map.{length}')
+    def setup(length=length):
+        def run():
+            items = range(N)
+            for repetition in range(length):
+                items = map(inc, items)
+            for item in items:
+                noop(item)
+        return run
+
+    @benchmark(f'filter.{length}')
+    def setup(length=length):
+        network = pipe(*[{true}] * length, sink(noop))
+        return lambda: network(range(N))
+
+    @benchmark(f'python.filter.{length}')
+    def setup(length=length):
+        def run():
+            items = range(N)
+            for repetition in range(length):
+                items = filter(true, items)
+            for item in items:
+                noop(item)
+        return run
+
+    @benchmark(f'flat.{length}')
+    def setup(length=length):
+        network = pipe(*[flat(one)] * length, sink(noop))
+        return lambda: network(range(N))
+
+    @benchmark(f'join.{length}')
+    def setup(length=length):
+        network = pipe(*[(one, join)] * length, sink(noop))
+        return lambda: network(range(N))
+
+    @benchmark(f'branch.fan-out.{length}')
+    def setup(length=length):
+        network = pipe(*[[sink(noop)]] * length, sink(noop))
+        return lambda: network(range(N))
+
+    @benchmark(f'branch.nested.{length}')
+    def setup(length=length):
+        branch = [sink(noop)]
+        for level in range(length - 1):
+            branch = [branch, sink(noop)]
+        network = pipe(branch, sink(noop))
+        return lambda: network(range(N))
+
+
+@benchmark('put')
+def setup():
+    data = [Namespace(a=n) for n in range(N)]
+    network = pipe(get.a * inc >> put.b, sink(noop))
+    return lambda: network(data)
+
+@benchmark('on')
+def setup():
+    data = [Namespace(a=n) for n in range(N)]
+    network = pipe(on.a(inc), sink(noop))
+    return lambda: network(data)
+
+# Namespaces made inside the pipe are not shared, so `on` can update in place
+@benchmark('on.unshared')
+def setup():
+    network = pipe(name.a, on.a(inc), on.a(inc), on.a(inc), sink(noop))
+    return lambda: network(range(N))
+
+@benchmark('on.record')
+def setup():
+    network = pipe(record.a, on.a(inc), on.a(inc), on.a(inc), sink(noop))
+    return lambda: network(range(N))
+
+
+for close_all in (False, True):
+    suffix = '.close_all' if close_all else ''
+
+    @benchmark(f'take.half{suffix}')
+    def setup(close_all=close_all):
+        network = pipe(take(N // 2, close_all=close_all), sink(noop))
+        return lambda: network(range(N))
+
+    @benchmark(f'drop.half{suffix}')
+    def setup(close_all=close_all):
+        network = pipe(drop(N // 2, close_all=close_all), sink(noop))
+        return lambda: network(range(N))
+
+
+
+# Once the take is satisfied, the rest of the source is not read: this
+# measures how quickly a finished network stops.
+@benchmark('take.first')
+def setup():
+    network = pipe(take(1), sink(noop))
+    return lambda: network(range(N))
+
+
+# Temporary directories holding the benchmarks' files, removed after the run
+scratch = []
+
+def text_file():
+    scratch.append(tempfile.TemporaryDirectory())
+    path = os.path.join(scratch[-1].name, 'lines.txt')
+    with open(path, 'w') as file:
+        file.write(''.join(f'{n}\n' for n in range(N)))
+    return path
+
+@benchmark('file.lines')
+def setup():
+    network, source = pipe(sink(noop)), lines(text_file())
+    return lambda: network(source)
+
+@benchmark('file.lines.batch')
+def setup():
+    network, source = pipe(sink(noop), batch=1024), lines(text_file())
+    return lambda: network(source)
+
+@benchmark('file.write_lines')
+def setup():
+    network = pipe(write_lines(text_file()))
+    return lambda: network(range(N))
+
+
+@benchmark('group_by')
+def setup():
+    network = pipe(group_by(_ // 8), sink(noop))
+    return lambda: network(range(N))
+
+@benchmark('window.8')
+def setup():
+    network = pipe(window(8), sink(noop))
+    return lambda: network(range(N))
+
+for size in (None, 1024):
+    suffix = '' if size is None else '.batch'
+
+    @benchmark(f'chunk.64{suffix}')
+    def setup(size=size):
+        network = pipe(batch(64), sink(noop), batch=size)
+        return lambda: network(range(N))
+
+
+def count_into(counts, key):
+    counts[key] = counts.get(key, 0) + 1
+    return counts
+
+# Counting per key with a fold over a dict, the way it was done before `by`
+@benchmark('keyed.fold-dict')
+def setup():
+    network = pipe(_ % 100, out(count_into, {}))
+    return lambda: network(range(N))
+
+for size in (None, 1024):
+    suffix = '' if size is None else '.batch'
+
+    @benchmark(f'keyed.count{suffix}')
+    def setup(size=size):
+        network = pipe(out(len, by=_ % 100), batch=size)
+        return lambda: network(range(N))
+
+    @benchmark(f'keyed.stats{suffix}')
+    def setup(size=size):
+        network = pipe(out(by=_ % 100, fold=dict(n=len, total=sum, low=min, high=max)), batch=size)
+        return lambda: network(range(N))
+
+
+# Routing by key: one filtered branch per route, against a single dispatch
+@benchmark('route.branches.4')
+def setup():
+    network = pipe(*[[{_ % 4 == n}, sink(noop)] for n in range(4)], sink(noop))
+    return lambda: network(range(N))
+
+for size in (None, 1024):
+    suffix = '' if size is None else '.batch'
+
+    @benchmark(f'route.dispatch.4{suffix}')
+    def setup(size=size):
+        network = pipe(dispatch(_ % 4, {n: sink(noop) for n in range(4)}), sink(noop), batch=size)
+        return lambda: network(range(N))
+
+
+def reciprocal(x): return 1 / x
+
+# One call in a hundred raises: the network is rebuilt after each failure
+@benchmark('fn.recover')
+def setup():
+    fn = pipe(reciprocal, {true}).fn(ZeroDivisionError)
+    return lambda: [fn(x % 100) for x in range(N)]
+
+
+@benchmark('fn.call')
+def setup():
+    fn = pipe(inc).fn()
+    return lambda: [fn(x) for x in range(N)]
+
+@benchmark('python.fn.call')
+def setup():
+    return lambda: [inc(x) for x in range(N)]
+
+
+# Starting a fresh interpreter which imports liquidata. There are no items:
+# as with the other benchmarks, the time is divided by N.
+@benchmark('import')
+def setup():
+    python('-c', 'import liquidata')
+    return lambda: python('-c', 'import liquidata')
+
+
+# Pulling each result out of the network, compared with pushing them all to a sink
+@benchmark('iter.map')
+def setup():
+    network = pipe(inc)
+    return lambda: list(network.iter(range(N)))
+
+@benchmark('iter.map.batch')
+def setup():
+    network = pipe(inc, batch=64)
+    return lambda: list(network.iter(range(N)))
+
+
+# The cost of handing items to another thread, with nothing to overlap
+for suffix, options in (('', {}), ('.batch', dict(batch=64))):
+
+    @benchmark(f'stage_boundary{suffix}')
+    def setup(options=options):
+        network = pipe(inc, stage_boundary(), inc, sink(noop), **options)
+        return lambda: network(range(N))
+
+
+# Deduplication: exact with unbounded and LRU-bounded memory, then probabilistic
+@benchmark('distinct')
+def setup():
+    network = pipe(distinct(_ % 1000), sink(noop))
+    return lambda: network(range(N))
+
+@benchmark('distinct.lru')
+def setup():
+    network = pipe(distinct(_ % 1000, maxsize=100), sink(noop))
+    return lambda: network(range(N))
+
+@benchmark('probably_unseen')
+def setup():
+    network = pipe(probably_unseen(1000, key=_ % 1000), sink(noop))
+    return lambda: network(range(N))
+
+@benchmark('distinct_count')
+def setup():
+    network = pipe(out(distinct_count))
+    return lambda: network(range(N))
+
+
+# Repeats are interleaved across benchmarks, so that a period when the machine
+# is slow affects one repeat of many benchmarks, rather than all repeats of one.
+def run(patterns=('*',), repeats=5):
+    try:
+        thunks = {name: setup() for name, setup in benchmarks.items()
+                  if any(fnmatch.fnmatch(name, pattern) for pattern in patterns)}
+        results = dict.fromkeys(thunks, float('inf'))
+        for repetition in range(repeats):
+            for name, thunk in thunks.items():
+                results[name] = min(results[name], best_of(thunk, repeats=1) / N * 1e9)
+        return results
+    finally:
+        while scratch:
+            scratch.pop().cleanup()
+
+
+def environment():
+    return dict(python=sys.version.split()[0], implementation=platform.python_implementation(),
+                machine=platform.machine(), N=N)
+
+
+# Results are merged into the existing baseline, so that a subset of the
+# benchmarks can be re-recorded.
+def save(results, filename):
+    try:
+        results = {**load(filename), **results}
+    except FileNotFoundError:
+        pass
+    with open(filename, 'w') as file:
+        json.dump(dict(environment=environment(), ns_per_item=results), file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+# Returns the names of benchmarks which are slower than the baseline by more
+# than `tolerance` (a fraction of the baseline time); the python.* benchmarks
+# themselves are never counted as regressions. If `calibrate`, times are first
+# scaled by how much faster or slower the plain-Python benchmarks ran than in
+# the baseline. That roughly factors out the speed of a different machine, but
+# the tiny python.* loops do not speed up or slow down like heavier benchmarks
+# (e.g. put and on, which allocate), so compare on one machine without it.
+def compare(results, baseline, tolerance=0.3, calibrate=False):
+    references = [results[name] / baseline[name] for name in results
+                  if name.startswith('python.') and name in baseline]
+    speed = geometric_mean(references) if calibrate and references else 1.0
+    regressions = []
+    print(f'{"benchmark":<28}{"ns/item":>12}{"baseline":>12}{"ratio":>10}   (machine speed factor {speed:.2f})')
+    for name, time in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f'{name:<28}{time:12.1f}{"":>12}{"":>10}')
+            continue
+        ratio = time / before / speed
+        regressed = ratio > 1 + tolerance and not name.startswith('python.')
+        if regressed:
+            regressions.append(name)
+        print(f'{name:<28}{time:12.1f}{before:12.1f}{ratio:10.2f}{"  REGRESSION" if regressed else ""}')
+    return regressions
+
+
+def geometric_mean(values):
+    return math.exp(sum(map(math.log, values)) / len(values))
+
+
+def load(filename):
+    with open(filename) as file:
+        return json.load(file)['ns_per_item']
+
+
+BASELINE = 'liquidata_bench_baseline.json'
+
+def main(argv=None):
+    parser = ArgumentParser(description='Time liquidata components against a stored baseline.')
+    parser.add_argument('patterns', nargs='*', default=['*'], help='glob patterns selecting benchmarks')
+    parser.add_argument('--baseline' , default=BASELINE, help=f'baseline file (default {BASELINE})')
+    parser.add_argument('--save'     , action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='allowed slowdown before failing')
+    parser.add_argument('--calibrate', action='store_true', help='scale times by the speed of the machine (to compare'
+                                                                   ' with a baseline recorded on another one)')
+    parser.add_argument('--repeats'  , type=int  , default=5)
+    parser.add_argument('--tables'   , action='store_true', help='print the batch, call, column, allocation and import tables instead')
+    args = parser.parse_args(argv)
+
+    if args.tables:
+        bench_batch()
+        print()
+        bench_call_overhead()
+        print()
+        bench_columns()
+        print()
+        bench_allocations()
+        print()
+        bench_import()
+        return 0
+
+    results = run(args.patterns, args.repeats)
+    if args.save:
+        save(results, args.baseline)
+        return 0
+    try:
+        baseline = load(args.baseline)
+    except FileNotFoundError:
+        baseline = {}
+    return 1 if compare(results, baseline, args.tolerance, calibrate=args.calibrate) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,6 +4,7 @@ from argparse  import Namespace
 from copy      import copy
 
 import itertools as it
+import sys
 
 from pytest import mark, raises
 xfail = mark.xfail
@@ -130,6 +131,59 @@ def test_fold_into_named_out():
     assert pipe(out.X(into(set)))(data).X == set(data)
 
 
+
+@parametrize('batch', (None, 3))
+def test_keyed_fold(batch):
+    from liquidata import pipe, out
+    data = 'abracadabra'
+    result = pipe([out.groups(by=str.upper)],
+                  [out.counts(len, by=str.upper)],
+                  out.joined(sym_add, by=str.upper), batch=batch)(data)
+    assert result.counts == dict(A=5, B=2, R=2, C=1, D=1)
+    assert result.groups == dict(A=list('aaaaa'), B=list('bb'), R=list('rr'), C=['c'], D=['d'])
+    assert result.joined == dict(A=reduce(sym_add, 'aaaaa'), B=sym_add('b', 'b'), R=sym_add('r', 'r'), C='c', D='d')
+
+
+@parametrize('batch', (None, 3))
+def test_keyed_fold_anonymous_and_into(batch):
+    from liquidata import pipe, out, into
+    data = 'abracadabra'
+    assert pipe(out(by=str.upper), batch=batch)(data) == dict(A=list('aaaaa'), B=list('bb'), R=list('rr'),
+                                                             C=['c'], D=['d'])
+    assert pipe(out.X(into(sorted), by=str.islower), batch=batch)(data).X == {True: sorted(data)}
+    assert pipe(out(into(sum), by=odd), batch=batch)(range(6)) == {False: 6, True: 9}
+
+
+@parametrize('batch', (None, 4))
+def test_keyed_fold_several_aggregates(batch):
+    from statistics import mean
+    from liquidata import pipe, out, get
+    data = [Namespace(who=who, spent=spent) for who, spent in zip('xyxxy', (1, 5, 3, 8, 7))]
+    net = pipe(out.spend(by=get.who, value=get.spent, fold=dict(n=len, total=sum, low=min, high=max, mean=mean)),
+               batch=batch)
+    assert net(data).spend == dict(x=Namespace(n=3, total=12, low=1, high=8, mean=4),
+                                   y=Namespace(n=2, total=12, low=5, high=7, mean=6))
+    assert pipe(out(by=get.who, value=get.spent, fold=(len, max)), batch=batch)(data) == dict(x=(3, 8), y=(2, 7))
+
+
+def test_keyed_fold_initial_value_is_per_key():
+    from liquidata import pipe, out, arg as _
+    def append(the_list, item):
+        return the_list + [item]
+    assert pipe(out(append, [], by=_ % 2))(range(5)) == {0: [0, 2, 4], 1: [1, 3]}
+
+
+@parametrize('batch', (None, 16))
+def test_keyed_fold_top(batch):
+    from liquidata import pipe, out, arg as _
+    data = [7] * 40 + list(range(100)) + [3] * 20
+    counts = pipe(out(len, by=_ % 10, top=2), batch=batch)(data)
+    assert list(counts) == [7, 3]
+    assert counts[7] >= 40
+    with raises(ValueError):
+        pipe(out(len, by=_, top=0))
+
+
 def test_return_value_from_branch():
     from liquidata import pipe, out
     data = range(3)
@@ -228,6 +282,25 @@ def test_pipe_as_safe_multi_arg_function():
     assert pipe_fn(6,7) == f(sym_add(6,7))
 
 
+
+def test_pipe_as_multi_arg_function_on_other_components():
+    from liquidata import pipe, flat, Many
+    assert pipe(flat(lambda a, b: range(a, b))).fn()(2, 5) == Many((2, 3, 4))
+    assert pipe({lambda a, b: a < b}, len).fn()(1, 2) == 2
+    assert pipe(pipe(sym_add, len)).fn()(1, 2) == len(sym_add(1, 2))
+
+
+def test_pipe_function_several_args_pass_through_non_functions():
+    from liquidata import pipe, take, sink, stage_boundary, join
+    seen = []
+    assert pipe(take(2), sym_add).fn()(1, 2) == sym_add(1, 2)
+    assert pipe(stage_boundary(), sym_add).fn()(1, 2) == sym_add(1, 2)
+    assert pipe([sink(lambda a, b: seen.append(a + b))], sym_add).fn()(3, 4) == sym_add(3, 4)
+    assert seen == [7]
+    assert pipe([take(1), sym_mul], sym_add).fn()(5, 6) == sym_add(5, 6)
+    with raises(TypeError):
+        pipe(join).fn()(1, 2)
+
 def test_pipe_as_function_on_filter():
     from liquidata import pipe
     f = odd
@@ -260,6 +333,83 @@ def test_pipe_as_safe_function_on_flat():
     assert pipe_fn(5) == Many((0,1,2,3,4))
 
 
+
+def test_pipe_function_recovers_after_exception():
+    from liquidata import pipe, flat
+    fn = pipe(flat(lambda n: range(n, 3)), lambda x: 6 // x).fn(tuple)
+    assert fn(1) == (6, 3)
+    with raises(ZeroDivisionError):
+        fn(0)
+    assert fn(1) == (6, 3) # network is rebuilt, not dead
+
+
+def test_pipe_function_returns_isolated_exceptions():
+    from liquidata import pipe, flat, Many
+    fn = pipe(flat(lambda n: range(n, 3)), lambda x: 6 // x).fn(ZeroDivisionError)
+    assert isinstance(fn(0), ZeroDivisionError)
+    assert fn(1) == Many((6, 3))
+    with raises(TypeError):
+        fn('x')
+    assert fn(2) == 3
+    assert pipe(lambda x: 6 // x).fn(ArithmeticError)(3) == 2
+
+
+def test_pipe_function_stopped_by_close_all():
+    from liquidata import pipe, take
+    fn = pipe(take(2, close_all=True)).fn(tuple)
+    assert [fn(x) for x in range(4)] == [(0,), (1,), (), ()]
+
+
+# Maps-only pipes take a shortcut past the network: both must stop alike
+@parametrize('components', ((square,), (square, {odd})))
+def test_pipe_function_stopped_by_function(components):
+    from liquidata import pipe, StopPipeline
+    def stop_at_2(n):
+        if n == 2:
+            raise StopPipeline
+        return n
+    fn = pipe(stop_at_2, *components).fn(tuple)
+    assert [fn(x) for x in (1, 3, 2, 1)] == [(1,), (9,), (), ()]
+
+
+@parametrize('options', (dict(), dict(batch=3), dict(columns=3)))
+def test_pipe_iter(options):
+    from liquidata import pipe, out, arg as _
+    net = pipe(_ * 3, [out.X], {odd}, **options)
+    assert list(net.iter(range(10))) == [3, 9, 15, 21, 27]
+
+
+def test_pipe_iter_is_lazy():
+    from liquidata import pipe
+    read, closed = [], []
+    def source():
+        try:
+            for n in range(100):
+                read.append(n)
+                yield n
+        finally:
+            closed.append(True)
+    items = pipe(square, {odd}).iter(source())
+    assert next(items) == 1
+    assert next(items) == 9
+    assert read == [0, 1, 2, 3]
+    items.close()
+    assert closed
+
+
+@parametrize('batch', (None, 4))
+def test_pipe_iter_flushes_at_end_of_source(batch):
+    from liquidata import pipe, group_by, take, arg as _
+    assert list(pipe(group_by(_ // 3), batch=batch).iter(range(7))) == [(0, [0, 1, 2]), (1, [3, 4, 5]), (2, [6])]
+    assert list(pipe(take(2, close_all=True),   batch=batch).iter(it.count())) == [0, 1]
+
+
+def test_pipe_iter_needs_main_output():
+    from liquidata import pipe, out
+    with raises(ValueError):
+        pipe(square, out.X).iter(range(3))
+
+
 def test_Void_str():
     from liquidata import Void
     assert str(Void) == 'Void'
@@ -322,6 +472,58 @@ def test_on():
     assert net(data) == expected
 
 
+@mark.parametrize('batch', (None, 2))
+def test_put_does_not_modify_shared_namespaces(batch):
+    from liquidata import pipe, on, name, out
+    data = [Namespace(a=n) for n in range(3)]
+    assert pipe(on.a(square), out, batch=batch)(data) == [Namespace(a=n*n) for n in range(3)]
+    assert data == [Namespace(a=n) for n in range(3)]
+    result = pipe(name.a, [out.before], on.a(square), out.after, batch=batch)(range(3))
+    assert result.before == [Namespace(a=n  ) for n in range(3)]
+    assert result.after  == [Namespace(a=n*n) for n in range(3)]
+
+
+@mark.parametrize('boundary', (False, True))
+@mark.parametrize('batch', (None, 2, 7))
+@mark.parametrize('make', ('name', 'record'))
+def test_put_in_branch_does_not_modify_items_seen_downstream(make, batch, boundary):
+    import liquidata
+    from liquidata import pipe, put, out, stage_boundary, arg as _
+    side = (stage_boundary(chunk=2),) if boundary else ()
+    result = pipe(getattr(liquidata, make).a, [*side, _.a * 2 >> put.b, out.X], out.Y, batch=batch)(range(5))
+    assert [(x.a, x.b) for x in result.X] == [(n, n * 2) for n in range(5)]
+    assert [vars(y) if make == 'name' else y._asdict() for y in result.Y] == [dict(a=n) for n in range(5)]
+
+
+@mark.skipif(sys.implementation.name != 'cpython', reason='needs reference counts')
+@mark.parametrize('batch', (None, 2))
+@mark.parametrize('make', ('name', 'record'))
+def test_put_updates_unshared_namespaces_in_place(make, batch):
+    import liquidata
+    from liquidata import pipe, on, out
+    before, after = [], []
+    def spy(ids):
+        return lambda ns: ids.append(id(ns)) or ns
+    net = pipe(getattr(liquidata, make).a, spy(before), on.a(square), spy(after), out, batch=batch)
+    assert net(range(5)) == [Namespace(a=n*n) for n in range(5)]
+    assert before == after
+
+
+def test_record():
+    import pickle
+    from liquidata import pipe, record, get, put, on, out, Record
+    net = pipe(record.a.b, on.a(square), get.a * square >> put.c, out)
+    result = net(zip(range(3), 'xyz'))
+    assert result == [Namespace(a=n*n, b=b, c=n**4) for n, b in zip(range(3), 'xyz')]
+    first = result[0]
+    assert isinstance(first, Record)
+    assert first._fields == ('a', 'b', 'c')
+    assert repr(first) == "record(a=0, b='x', c=0)"
+    assert pickle.loads(pickle.dumps(first)) == first
+    assert not hasattr(first, '__dict__')
+    with raises(AttributeError):
+        first.d = 1
+
 def test_get_single_attr():
     from liquidata import get
     it = Namespace(a=1, b=2)
@@ -665,6 +867,15 @@ def test_slice_downstream(spec):
 # over all its entries. However, when set to True, the behaviour
 # is to close the outermost pipeline, resulting in a full stop of
 # the data flow.
+@parametrize('spec', ((1, None, 2), (3, None), (None, 4), (2, 9, 3)))
+def test_slice_same_result_on_every_call(spec):
+    from liquidata import pipe, Slice
+    net = pipe(Slice(*spec))
+    expected = list(range(10))[slice(*spec)]
+    assert net(range(10)) == expected
+    assert net(range(10)) == expected
+
+
 @parametrize("close_all", (False, True))
 def test_slice_close_all(close_all):
     from liquidata import Slice, pipe, out
@@ -696,12 +907,12 @@ def test_slice_raises_ValueError(args):
         Slice(*args)
 
 
-from operator import   eq, ne, lt, gt, le, ge, add, sub, mul, floordiv, truediv
-binops = sampled_from((eq, ne, lt, gt, le, ge, add, sub, mul, floordiv, truediv))
+from operator import   eq, ne, lt, gt, le, ge, add, sub, mul, floordiv, truediv, mod, and_, or_, xor
+binops = sampled_from((eq, ne, lt, gt, le, ge, add, sub, mul, floordiv, truediv, mod, and_, or_, xor))
 
 @given(binops, integers(), integers())
 def test_arg_as_lambda_binary(op, lhs, rhs):
-    assume(op not in (truediv, floordiv) or rhs != 0)
+    assume(op not in (truediv, floordiv, mod) or rhs != 0)
     from liquidata import arg
 
     a  =           op(arg, rhs)
@@ -712,11 +923,11 @@ def test_arg_as_lambda_binary(op, lhs, rhs):
     assert ar(rhs) == br(rhs)
 
 
-from operator import  neg, pos
-unops = sampled_from((neg, pos, abs))
+from operator import  neg, pos, invert
+unops = sampled_from((neg, pos, abs, invert))
 
 @given(unops, integers())
-def test_arg_as_lambda_binary(op, operand):
+def test_arg_as_lambda_unary(op, operand):
     from liquidata import arg
     assert op(arg)(operand) == op(operand)
 
@@ -756,6 +967,38 @@ def test_arg_as_lambda_call_keyword_args():
     assert (arg(a=6, b=7))(dict) == (lambda x: x(a=6, b=7))(dict)
 
 
+def test_arg_expressions_combine():
+    from liquidata import arg
+    data = Namespace(a=Namespace(b=[3, 4]), c=2)
+    assert (arg.a.b[1] * arg.c > arg.c + 5)(data) == (lambda x: x.a.b[1] * x.c > x.c + 5)(data)
+    assert ('<' + arg + '>')('x') == '<x>'
+
+
+def test_arg_expression_repr():
+    from liquidata import arg
+    assert repr(arg.a[0] > 3)      == "(arg.a[0] > 3)"
+    assert repr(-abs(arg) + 'x')   == "((-abs(arg)) + 'x')"
+    assert repr(arg(2, k=arg.n))   == "arg(2, k=arg.n)"
+
+
+def test_arg_expression_pickles():
+    import pickle
+    from liquidata import arg
+    assert pickle.loads(pickle.dumps(arg.a[1] + 'z'))(Namespace(a='xy')) == 'yz'
+    assert pickle.loads(pickle.dumps(arg[1] * 10))([2, 3]) == 30
+    used = arg * 2
+    assert used(3) == 6
+    assert pickle.loads(pickle.dumps(used))(4) == 8
+
+
+@mark.parametrize('batch', (None, 4))
+def test_fused_arg_expressions(batch):
+    from liquidata import pipe, arg, out, into
+    data = [Namespace(a=n, b=n % 3) for n in range(20)]
+    net = pipe({arg.a > 3}, {odd: arg.b}, {arg % 2 == 0: arg.a}, arg.a * arg.b, -arg, out(into(list)), batch=batch)
+    assert net(data) == [-n * (n % 3) for n in range(20) if n > 3 and n % 3 % 2 and n % 2 == 0]
+
+
 # TODO test close_all for take, drop, until, while_, ...
 def test_take():
     from liquidata import pipe, take
@@ -783,3 +1026,997 @@ def test_while():
     expected = ''.join(it.takewhile(_ != 'X', data))
     got      = ''.join(pipe(while_ (_ != 'X'))(data))
     assert got == expected
+
+
+class CountingSource:
+
+    def __init__(self, n=None):
+        self.n, self.pulled, self.closed = n, 0, False
+
+    def __iter__(self):
+        try:
+            for item in (it.count() if self.n is None else range(self.n)):
+                self.pulled += 1
+                yield item
+        finally:
+            self.closed = True
+
+
+@mark.parametrize('batch', (None, 4))
+def test_finished_sinks_stop_reading_the_source(batch):
+    from liquidata import pipe, take
+    source = CountingSource()
+    assert pipe(take(3), batch=batch)(iter(source)) == [0, 1, 2]
+    assert source.pulled <= 4
+    assert source.closed
+
+
+@mark.parametrize('batch', (None, 4))
+def test_finished_until_stops_reading_the_source(batch):
+    from liquidata import pipe, until, arg as _
+    source = CountingSource()
+    assert pipe(until(_ > 4), batch=batch)(iter(source)) == [0, 1, 2, 3, 4]
+    assert source.pulled <= 8
+
+
+@mark.parametrize('batch', (None, 4))
+def test_live_branches_keep_the_source_flowing(batch):
+    from liquidata import pipe, take, out
+    source = CountingSource(20)
+    result = pipe([take(2), out.few], out.all, batch=batch)(iter(source))
+    assert result.few == [0, 1]
+    assert result.all == list(range(20))
+    source = CountingSource()
+    result = pipe([take(2), out.few], take(5), out.more, batch=batch)(iter(source))
+    assert result.few  == [0, 1]
+    assert result.more == [0, 1, 2, 3, 4]
+    assert source.pulled <= 8
+
+
+def test_finished_nested_pipe_does_not_finish_outer_pipe():
+    from liquidata import pipe, take, flat
+    source = CountingSource(6)
+    assert pipe((flat(range), take(3)))(iter(source)) == [0, 0, 1]
+    assert source.pulled == 6
+
+
+
+@parametrize('suffix', ('', '.gz', '.bz2', '.xz'))
+@parametrize('batch', (None, 7))
+def test_lines_round_trip(tmp_path, suffix, batch):
+    from liquidata import pipe, lines, write_lines
+    path = tmp_path / ('data.txt' + suffix)
+    pipe(str, write_lines(path), batch=batch)(range(3000))
+    assert pipe(int, batch=batch)(lines(path)) == list(range(3000))
+
+
+def test_lines_without_final_newline(tmp_path):
+    from liquidata import pipe, out, lines
+    path = tmp_path / 'data.txt'
+    path.write_text('a\n\nb\nc')
+    assert pipe(out)(lines(path)) == ['a', '', 'b', 'c']
+
+
+@parametrize('batch', (None, 2))
+def test_csv_round_trip(tmp_path, batch):
+    from liquidata import pipe, out, csv_rows, write_csv
+    path = tmp_path / 'data.csv'
+    pipe(write_csv(path), batch=batch)([(1, 'a,b'), (2, 'c')])
+    assert pipe(out, batch=batch)(csv_rows(path)) == [['1', 'a,b'], ['2', 'c']]
+    pipe(write_csv(path, fields=['x', 'y']), batch=batch)([dict(x=1, y='p'), dict(x=2, y='q')])
+    assert path.read_text().splitlines()[0] == 'x,y'
+    assert pipe(out, batch=batch)(csv_rows(path, header=True)) == [dict(x='1', y='p'), dict(x='2', y='q')]
+
+
+def test_json_lines_round_trip(tmp_path):
+    from liquidata import pipe, out, json_lines, write_json_lines
+    path = tmp_path / 'data.jsonl.gz'
+    data = [dict(a=[1, 2]), 3, 'x', None]
+    pipe(write_json_lines(path))(data)
+    assert pipe(out, batch=3)(json_lines(path)) == data
+
+
+@parametrize('suffix', ('', '.gz'))
+@parametrize('batch', (None, 3))
+def test_binary_records(tmp_path, suffix, batch):
+    import struct
+    from liquidata import pipe, out, binary_records, open_file
+    path = tmp_path / ('data.bin' + suffix)
+    data = [(n, n / 2) for n in range(10)]
+    with open_file(path, 'wb') as file:
+        file.write(b''.join(struct.pack('<id', *record) for record in data))
+    assert pipe(out, batch=batch)(binary_records(path, '<id')) == data
+
+
+def test_binary_records_size_mismatch(tmp_path):
+    from liquidata import pipe, out, binary_records
+    empty, bad = tmp_path / 'empty.bin', tmp_path / 'bad.bin'
+    empty.write_bytes(b'')
+    bad  .write_bytes(b'123')
+    assert pipe(out)(binary_records(empty, '<i')) == []
+    with raises(ValueError):
+        pipe(out)(binary_records(bad, '<i'))
+
+
+def test_file_source_in_source_position(tmp_path):
+    from liquidata import pipe, source, lines, take
+    path = tmp_path / 'data.txt'
+    path.write_text('a\nb\nc\n')
+    assert pipe(source << lines(path), take(2)) == ['a', 'b']
+    assert pipe(lines(path) >> source, str.upper) == ['A', 'B', 'C']
+
+
+
+def test_group_by():
+    from liquidata import pipe, group_by, arg as _
+    data = 'aabcccab'
+    assert pipe(group_by())(data) == [('a', ['a', 'a']), ('b', ['b']), ('c', ['c', 'c', 'c']),
+                                      ('a', ['a']), ('b', ['b'])]
+    assert pipe(group_by(_ < 'c'))(data) == [(True, list('aab')), (False, list('ccc')), (True, list('ab'))]
+    assert pipe(group_by())([]) == []
+
+
+@parametrize('n, step', ((3, 1), (3, 3), (2, 3), (1, 2), (5, 1)))
+def test_window(n, step):
+    from liquidata import pipe, window
+    data = range(10)
+    expected = [tuple(data[start : start + n]) for start in range(0, len(data) - n + 1, step)]
+    assert pipe(window(n, step))(data) == expected
+
+
+def test_time_window():
+    from liquidata import pipe, time_window, arg as _
+    events = [dict(t=t) for t in (1, 2, 6, 7, 9, 21)]
+    times  = pipe(time_window(5, _['t']), lambda w: (w[0], [e['t'] for e in w[1]]))
+    assert times(events) == [(0, [1, 2]), (5, [6, 7, 9]), (20, [21])]
+    sliding = pipe(time_window(4, itemgetter('t'), step=2), lambda w: (w[0], [e['t'] for e in w[1]]))
+    assert sliding(events) == [(-2, [1]), (0, [1, 2]), (2, [2]), (4, [6, 7]), (6, [6, 7, 9]),
+                               (8, [9]), (18, [21]), (20, [21])]
+    with raises(ValueError):
+        times([dict(t=3), dict(t=2)])
+
+
+def test_batch_chunks():
+    from liquidata import pipe, batch
+    assert pipe(batch(3))(range(8)) == [[0, 1, 2], [3, 4, 5], [6, 7]]
+    assert pipe(batch(3), batch=2)(range(8)) == [[0, 1, 2], [3, 4, 5], [6, 7]]
+    assert pipe(batch(4))(range(8)) == [[0, 1, 2, 3], [4, 5, 6, 7]]
+
+
+@parametrize('batch', (None, 4))
+def test_groups_are_sent_as_soon_as_they_close(batch):
+    from liquidata import pipe, group_by, window, take, arg as _
+    source = CountingSource()
+    assert pipe(group_by(_ // 3), take(2), batch=batch)(iter(source)) == [(0, [0, 1, 2]), (1, [3, 4, 5])]
+    assert source.pulled <= 10
+    source = CountingSource()
+    assert pipe(window(3), take(2), batch=batch)(iter(source)) == [(0, 1, 2), (1, 2, 3)]
+    assert source.pulled <= 8
+
+
+@parametrize('component', ('window(0)', 'window(2, 0)', 'batch(0)', 'time_window(0, abs)'))
+def test_grouping_rejects_empty_sizes(component):
+    from liquidata import window, batch, time_window
+    with raises(ValueError):
+        eval(component)
+
+
+
+@parametrize('batch', (None, 3))
+def test_dispatch(batch):
+    from liquidata import pipe, dispatch, out, arg as _
+    data = range(10)
+    net = pipe(dispatch(_ % 3, {0: out.zero, 1: [_ * 10, out.ten]}), out.rest, batch=batch)
+    assert net(data) == Namespace(zero=[0, 3, 6, 9], ten=[10, 40, 70], rest=[2, 5, 8], **{'return': ()})
+    net = pipe(dispatch(_ % 3, {0: out.zero}, default=(_ + 1, out.other)), out.main, batch=batch)
+    result = net(data)
+    assert result.other == [2, 3, 5, 6, 8, 9]
+    assert result.main  == []
+
+
+def test_dispatch_evaluates_key_once():
+    from liquidata import pipe, dispatch, out
+    calls = []
+    def key(x):
+        calls.append(x)
+        return x % 2
+    assert pipe(dispatch(key, {0: out.even, 1: out.odd}))(range(6)).odd == [1, 3, 5]
+    assert calls == list(range(6))
+
+
+@parametrize('batch', (None, 4))
+def test_dispatch_finishes_when_every_route_has_finished(batch):
+    from liquidata import pipe, dispatch, out, take, arg as _
+    source = CountingSource()
+    result = pipe(dispatch(_ % 2, {0: [take(2), out.even]}), take(3), out.odd, batch=batch)(iter(source))
+    assert result.even == [0, 2]
+    assert result.odd  == [1, 3, 5]
+    assert source.pulled <= 12
+
+
+def test_distinct():
+    from liquidata import pipe, distinct, unique_by
+    data = [3, 1, 3, 2, 1, 4, -3]
+    assert pipe(distinct())(data) == [3, 1, 2, 4, -3]
+    assert pipe(distinct(abs))(data) == [3, 1, 2, 4]
+    assert pipe(unique_by(abs))(data) == [3, 1, 2, 4]
+    net = pipe(distinct())
+    assert net(data) == net(data)
+
+
+def test_distinct_forgets_least_recently_seen():
+    from liquidata import pipe, distinct
+    assert pipe(distinct(maxsize=2))([1, 2, 3, 1, 3, 3, 2]) == [1, 2, 3, 1, 2]
+    assert pipe(distinct(maxsize=2))([1, 2, 1, 3, 1, 2]) == [1, 2, 3, 2]
+    with raises(ValueError):
+        distinct(maxsize=0)
+
+
+def test_distinct_forgets_after_ttl():
+    from liquidata import pipe, distinct
+    clock = iter([0, 1, 2, 6, 7, 12]).__next__
+    data  =      [1, 2, 1, 2, 1,  2]
+    assert pipe(distinct(ttl=5, clock=clock))(data) == [1, 2, 2, 1, 2]
+    with raises(ValueError):
+        distinct(ttl=0)
+
+
+def test_probably_unseen():
+    from liquidata import pipe, probably_unseen
+    data = [n % 100 for n in range(1000)]
+    assert pipe(probably_unseen(100, key=lambda n: n // 2))(data) == list(range(0, 100, 2))
+    passed = pipe(probably_unseen(1000, error=0.01))(range(1000))
+    assert len(passed) > 970
+    assert passed == sorted(set(passed))
+    with raises(ValueError):
+        probably_unseen(100, error=1)
+
+
+@parametrize('n', (0, 1, 50, 2000, 30000))
+@parametrize('error', (0.01, 0.05))
+def test_distinct_count(n, error):
+    from liquidata import pipe, out, distinct_count
+    data = [str(i) for i in range(n)] * 2
+    estimate = pipe(out(distinct_count(error=error)))(data)
+    assert abs(estimate - n) <= 4 * error * n + 1
+
+
+def test_sketches_tell_apart_ints_which_hash_alike():
+    from liquidata import pipe, out, probably_unseen, distinct_count
+    data = [-1, -2, 5, 5 + 2**61 - 1, 2**70, 2**70 + 2**64, -2**63, 2**63]
+    assert pipe(probably_unseen(100))(data) == data
+    assert pipe(out(distinct_count))(data) == len(data)
+    assert pipe(probably_unseen(100))([3, 3.0, True, 1, 1.0]) == [3, True]
+
+
+def test_distinct_count_by_key():
+    from liquidata import pipe, out, distinct_count
+    assert pipe(out(by=odd, fold=distinct_count))(range(200)) == {False: 100, True: 100}
+
+
+def batch_equivalence_networks():
+    from liquidata import pipe, out, into, flat, join, take, drop, until, name, put, get, arg as _
+    from liquidata import group_by, window, time_window, batch, dispatch, stage_boundary
+    from liquidata import distinct, probably_unseen, distinct_count
+    f, g = symbolic_functions('fg')
+    return (( f, g                                          ),
+            ( {odd}, square                                 ),
+            ( {odd : _+1}, f                                ),
+            ( flat(range), out(add)                         ),
+            ( range, join, out.X(into(set))                 ),
+            ( [{even}, out.evens], f, out.fs                ),
+            ( [[f, out.BB], g, out.BM], [ {odd}, out.MB ], out.MM ),
+            ( out(sym_add, 99)                              ),
+            ( take(7)                                       ),
+            ( drop(3), {odd}, take(4)                       ),
+            ( [take(5, close_all=True), out.branch], out.main ),
+            ( [{odd}, take(3, close_all=True), out.B], out.M ),
+            ( until(_ > 12)                                 ),
+            ( until(_ > 100), take(2, close_all=True)       ),
+            ( until(_ > 12), [take(3, close_all=True), out.A], out.B ),
+            ( name.x, (get.x, f) >> put.y                   ),
+            ( (f, g), out.composed                          ),
+            ( group_by(_ // 3), take(4)                     ),
+            ( [window(4, 3), out.W], batch(6), out.B        ),
+            ( time_window(5, square, step=3)                ),
+            ( [batch(3), take(2, close_all=True), out.B], out.M ),
+            ( [out.A], take(2, close_all=True), out.B       ),
+            ( [group_by(_ // 3), out.G], take(5, close_all=True), out.B ),
+            ( [take(6, close_all=True), out.A], f, take(5, close_all=True), out.B ),
+            ( [take(3, close_all=True), out.A], [take(5, close_all=True), out.B], out.M ),
+            ( dispatch(_ % 3, {0: out.zero, 1: [f, out.one]})   ),
+            ( dispatch(_ % 3, {0: [take(2), out.A]}, default=[take(3), out.B]) ),
+            ( stage_boundary(chunk=3), [{odd}, f, out.O], g ),
+            ( distinct(_ % 7), [distinct(_ % 5, maxsize=2), out.D], out.C(distinct_count) ),
+            ( [probably_unseen(10, key=_ // 2), out.P], take(9), out.T ),
+    )
+
+@parametrize('batch', (1, 2, 3, 7, 1000))
+@parametrize('components', batch_equivalence_networks())
+def test_batch_mode_matches_item_mode(components, batch):
+    from liquidata import pipe
+    if not isinstance(components, tuple):
+        components = (components,)
+    data = range(20)
+    assert pipe(*components, batch=batch)(data) == pipe(*components)(data)
+
+
+@given(one_of(tuples(small_ints),
+              tuples(small_ints, small_ints),
+              tuples(slice_arg,  slice_arg, slice_arg_nonzero)),
+       small_ints_nonzero)
+def test_slice_batch_mode(spec, batch):
+    from liquidata import pipe, Slice
+    data = list('abcdefghij')
+    assert pipe(Slice(*spec), batch=batch)(data) == data[slice(*spec)]
+
+
+@parametrize('batch', (1, 3, 100))
+def test_batch_mode_StopPipeline_from_user_function(batch):
+    from liquidata import pipe, out, StopPipeline
+    def stop_at_7(n):
+        if n == 7:
+            raise StopPipeline
+        return n
+    result = pipe([stop_at_7, out.branch], out.main, batch=batch)(range(20))
+    assert result.branch == list(range(7))
+    assert result.main   == list(range(7))
+
+
+@parametrize('batch', (1, 3, 4, 100))
+def test_batch_mode_StopPipeline_downstream_of_until(batch):
+    from liquidata import pipe, until, StopPipeline, arg as _
+    def stop_at_7(n):
+        if n == 7:
+            raise StopPipeline
+        return n
+    assert pipe(until(_ > 100), stop_at_7, batch=batch)(range(25)) == list(range(7))
+
+
+@parametrize('batch', (1, 3, 100))
+def test_batch_mode_component_without_batch_loop(batch):
+    from liquidata import pipe, component, closing
+    @component
+    def twice():
+        def twice_loop(downstream):
+            with closing(downstream):
+                while True:
+                    args = yield
+                    downstream.send(args)
+                    downstream.send(args)
+        return twice_loop
+    data = range(10)
+    assert pipe(twice(), batch=batch)(data) == list(it.chain(*zip(data, data)))
+
+
+def test_batch_size_must_be_positive():
+    from liquidata import pipe
+    with raises(ValueError):
+        pipe(odd, batch=0)
+
+
+def test_fuse_collapses_runs_of_maps_and_filters():
+    from liquidata import fuse, decode_implicits, _Fused, _Branch, _Map, take, Slice
+    f, g = symbolic_functions('fg')
+    fused = tuple(fuse(map(decode_implicits, (f, {odd}, g, [f], g, take(3), f, g))))
+    assert tuple(map(type, fused)) == (_Fused, _Branch, _Map, Slice, _Fused)
+
+
+def fusible_networks():
+    from liquidata import out, arg as _
+    return (( odd, {odd}                                          ),
+            ( {odd}, {even}                                       ),
+            ( {odd : _+1}, square, {_ > 10}                       ),
+            ( square, _+1, _*2, [{odd}, out.X], {_ < 100}, out.Y  ),
+    )
+
+@parametrize('batch', (None, 3))
+@parametrize('components', fusible_networks())
+def test_fused_matches_unfused(components, batch, monkeypatch):
+    import liquidata
+    from liquidata import pipe
+    data = range(30)
+    fused = pipe(*components, batch=batch)(data)
+    monkeypatch.setattr(liquidata, 'FUSE', False)
+    assert fused == pipe(*components, batch=batch)(data)
+
+
+def test_fused_function_with_multiple_arguments():
+    from liquidata import pipe
+    f, = symbolic_functions('f')
+    assert pipe(sym_add, f, {len}).fn()(6, 7) == f(sym_add(6, 7))
+
+
+@parametrize('batch', (None, 2))
+def test_repeated_calls_start_afresh(batch):
+    from liquidata import pipe, out, into, take, get, put, name
+    f, = symbolic_functions('f')
+    net = pipe(name.x,
+               [get.x, out.first(into(list))],
+               [get.x, (take(2), f), out.nested],
+               (get.x, take(1)) >> put.y,
+               out.main(lambda acc, ns: acc + [ns.y], []),
+               batch=batch)
+    data = range(4)
+    first  = net(data)
+    second = net(data)
+    assert first == second
+    assert first.first  == list(data)
+    assert first.nested == list(map(f, range(2)))
+    assert first.main   == [0]
+
+
+def test_fold_initial_value_is_not_shared_between_calls():
+    from liquidata import pipe, out
+    def add_to_set(s, x):
+        s.add(x)
+        return s
+    net = pipe(out(add_to_set, set()))
+    assert net(range(3)) == {0, 1, 2}
+    assert net(range(3, 5)) == {3, 4}
+
+
+def test_decoded_components_are_cached():
+    from liquidata import pipe
+    net = pipe(square, {odd}, [square], square)
+    assert net.decoded_components() is net.decoded_components()
+
+
+# Slow modules are imported only when a pipe needs them
+def test_import_leaves_slow_modules_unloaded():
+    import subprocess, os
+    def loaded(code):
+        listing = f'import sys; {code}; print(*sys.modules)'
+        return set(subprocess.run([sys.executable, '-c', listing], capture_output=True, text=True, check=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split())
+    imported = loaded('import liquidata') - loaded('pass')
+    assert 'liquidata' in imported
+    assert not imported & {'argparse', 'asyncio', 'copy', 'inspect', 're'}
+
+
+def test_namespace_still_importable_from_liquidata():
+    import argparse
+    from liquidata import Namespace
+    assert Namespace is argparse.Namespace
+
+
+@parametrize('chunksize', (1, 4))
+@parametrize('batch', (None, 5))
+def test_parallel(chunksize, batch):
+    from liquidata import pipe, parallel
+    data = range(30)
+    net = pipe(parallel(square, workers=2, chunksize=chunksize), batch=batch)
+    assert net(data) == list(map(square, data))
+
+
+def test_parallel_unordered():
+    from liquidata import pipe, parallel
+    data = range(30)
+    got = pipe(parallel(square, workers=2, ordered=False))(data)
+    assert sorted(got) == list(map(square, data))
+
+
+@parametrize('batch', (None, 4))
+def test_parallel_close_all(batch):
+    from liquidata import pipe, parallel, take
+    data = range(100)
+    assert pipe(parallel(square, workers=2), take(5, close_all=True), batch=batch)(data) == list(map(square, range(5)))
+
+
+def test_parallel_in_fn():
+    from liquidata import pipe, parallel
+    fn = pipe(parallel(square, workers=2), {odd}).fn()
+    assert fn(3) == 9
+    assert fn(7) == 49
+
+
+def test_parallel_propagates_worker_exceptions():
+    from liquidata import pipe, parallel
+    with raises(ZeroDivisionError):
+        pipe(parallel(reciprocal, workers=2))(range(-3, 3))
+
+
+def test_parallel_chunksize_must_be_positive():
+    from liquidata import parallel
+    with raises(ValueError):
+        parallel(square, chunksize=0)
+
+
+@parametrize('batch', (None, 4))
+def test_pipe_parallel_merges_outputs_of_partitions(batch):
+    from liquidata import pipe, out, into, arg as _
+    net = pipe(square, [out.squares], [out.biggest(max)], [{odd}, out.odd(len, by=_ % 3)],
+               out.spread(dict(n=len, low=min), by=_ % 2), batch=batch)
+    partitions = range(0, 10), range(10, 25), range(25, 30)
+    assert net(range(30)) == net.parallel(partitions, workers=2)
+
+
+def test_pipe_parallel_single_output():
+    from liquidata import pipe, out, into
+    partitions = range(0, 10), range(10, 20)
+    assert pipe(square, {odd})             .parallel(partitions, workers=2) == pipe(square, {odd})(range(20))
+    assert pipe(square, out(into(sorted))) .parallel(partitions[::-1])      == sorted(map(square, range(20)))
+
+
+def test_pipe_parallel_fold_with_initial_needs_combine():
+    from liquidata import pipe, out, CombinerMissing
+    from operator  import add
+    partitions = range(0, 10), range(10, 20)
+    assert pipe(out(add, 0, combine=add)).parallel(partitions, workers=2) == sum(range(20))
+    with raises(CombinerMissing):
+        pipe(out(add, 0)).parallel(partitions, workers=2)
+
+
+def test_pipe_parallel_unknown_fold_needs_combine():
+    from liquidata import pipe, out, CombinerMissing, arg as _
+    from operator  import sub, add
+    partitions = range(0, 10), range(10, 20)
+    with raises(CombinerMissing):
+        pipe(out(sub)).parallel(partitions, workers=2)
+    with raises(CombinerMissing):
+        pipe(out(sub, by=_ % 2)).parallel(partitions, workers=2)
+    assert pipe(out(add, by=_ % 2)).parallel(partitions, workers=2) == {0: 90, 1: 100}
+    assert pipe(out(max)).parallel(partitions, workers=2) == 19
+
+
+def test_pipe_parallel_file_partitions(tmp_path):
+    from liquidata import pipe, out, lines
+    paths = []
+    for n in range(3):
+        paths.append(tmp_path / f'part{n}.txt')
+        paths[-1].write_text(''.join(f'{i}\n' for i in range(n * 10, n * 10 + 10)))
+    net = pipe(int, {odd}, out(len, by=odd))
+    assert net.parallel(map(lines, paths), workers=2) == {True: 15}
+
+
+def test_pipe_parallel_without_partitions():
+    from liquidata import pipe
+    assert pipe(square).parallel(()) == []
+
+
+@parametrize('batch', (None, 4))
+@parametrize('ordered', (True, False))
+def test_threaded(ordered, batch):
+    from liquidata import pipe, threaded
+    data = range(40)
+    got = pipe(threaded(square, workers=4, window=3, ordered=ordered), batch=batch)(data)
+    expected = list(map(square, data))
+    assert (got if ordered or batch else sorted(got)) == expected
+
+
+@parametrize('batch', (None, 4))
+def test_threaded_flat(batch):
+    from liquidata import pipe, threaded, flat
+    data = range(10)
+    got = pipe(threaded(flat(range), workers=3), batch=batch)(data)
+    assert got == list(it.chain(*map(range, data)))
+
+
+def test_threaded_star():
+    from liquidata import pipe, threaded, star
+    data = [(1,2), (3,4), (5,6)]
+    assert pipe(star(threaded(sym_add)))(data) == list(it.starmap(sym_add, data))
+
+
+@parametrize('batch', (None, 4))
+def test_threaded_close_all_in_branch(batch):
+    from liquidata import pipe, threaded, take, out
+    data = range(100)
+    result = pipe([threaded(square, workers=2), take(3, close_all=True), out.B], out.M, batch=batch)(data)
+    assert result.B == list(map(square, range(3)))
+
+
+@mark.skipif(sys.version_info < (3, 11), reason='exception notes need Python 3.11')
+def test_threaded_exception_identifies_failing_item():
+    from liquidata import pipe, threaded
+    with raises(ZeroDivisionError) as failure:
+        pipe(threaded(reciprocal, workers=2))([3, 2, 1, 0, 5])
+    assert any('to 0' in note for note in failure.value.__notes__)
+
+
+@parametrize('options', (dict(), dict(batch=4), dict(columns=4)))
+def test_stage_boundary(options):
+    from liquidata import pipe, stage_boundary, out, arg as _
+    import threading
+    threads = set()
+    def downstream(n):
+        threads.add(threading.get_ident())
+        return n
+    net = pipe(_ * 3, stage_boundary(maxsize=2, chunk=3), [{odd}, out.O], downstream, **options)
+    result = net(range(20))
+    assert result.O                   ==  [n * 3 for n in range(20) if odd(n)]
+    assert getattr(result, 'return')  == ([n * 3 for n in range(20)],)
+    assert threads and threading.get_ident() not in threads
+
+
+@parametrize('batch', (None, 4))
+def test_stage_boundary_stop_reaches_upstream(batch):
+    from liquidata import pipe, stage_boundary, take
+    read = []
+    def source():
+        for n in range(10_000):
+            read.append(n)
+            yield n
+    assert pipe(stage_boundary(chunk=1), take(3, close_all=True), batch=batch)(source()) == [0, 1, 2]
+    assert len(read) < 10_000
+
+
+@parametrize('batch', (None, 4))
+@parametrize('bad', (5, 500))
+def test_stage_boundary_propagates_exceptions(bad, batch):
+    from liquidata import pipe, stage_boundary
+    with raises(ZeroDivisionError):
+        pipe(stage_boundary(), lambda n: 1 / (n - bad), batch=batch)(range(1000))
+
+
+def test_stage_boundary_in_fn_and_iter():
+    from liquidata import pipe, stage_boundary
+    assert pipe(stage_boundary(), square).fn()(3) == 9
+    assert list(pipe(stage_boundary(chunk=2), square).iter(range(5))) == list(map(square, range(5)))
+    with raises(ValueError):
+        stage_boundary(maxsize=0)
+
+
+async def async_square(n):
+    from asyncio import sleep
+    await sleep(0.001 * (n % 3))
+    return n * n
+
+async def async_odd(n):
+    return n % 2 != 0
+
+async def async_range(n):
+    for i in range(n):
+        yield i
+
+async def async_source(data):
+    for item in data:
+        yield item
+
+
+def test_async_source():
+    from asyncio import run
+    from liquidata import pipe
+    f, = symbolic_functions('f')
+    assert run(pipe(f)(async_source(range(5)))) == list(map(f, range(5)))
+
+
+@parametrize('concurrency', (1, 3, 100))
+def test_async_map_filter_flat(concurrency):
+    from asyncio import run
+    from liquidata import pipe, flat, out
+    data = range(10)
+    net = pipe(async_square, [{async_odd}, out.odd], flat(async_range), out.flat, concurrency=concurrency)
+    result = run(net(data))
+    assert result.odd  == list(filter(odd, map(square, data)))
+    assert result.flat == list(it.chain(*map(range, map(square, data))))
+
+
+def test_async_pipe_with_async_source_and_fold():
+    from asyncio import run
+    from liquidata import pipe, source, out
+    assert run(pipe(source(async_source(range(6))), async_square, out(add))) == sum(map(square, range(6)))
+
+
+def test_async_close_all():
+    from asyncio import run
+    from liquidata import pipe, take
+    data = range(1000)
+    assert run(pipe(async_square, take(4, close_all=True))(data)) == list(map(square, range(4)))
+
+
+def test_async_exception_propagates():
+    from asyncio import run
+    from liquidata import pipe
+    async def fail_on_3(n):
+        if n == 3: raise ValueError(n)
+        return n
+    with raises(ValueError):
+        run(pipe(fail_on_3)(range(10)))
+
+
+def test_async_function_in_pipe_fn_is_rejected():
+    from liquidata import pipe, AsyncUnsupported
+    with raises(AsyncUnsupported):
+        pipe(async_square).fn()
+
+
+def test_async_in_pipe_iter_is_rejected():
+    from liquidata import pipe, AsyncUnsupported
+    with raises(AsyncUnsupported):
+        pipe(square).iter(async_range(3))
+    with raises(AsyncUnsupported):
+        pipe(async_square).iter(range(3))
+
+
+@parametrize('concurrency', (1, 4))
+def test_async_concurrency_limit(concurrency):
+    from asyncio import run, sleep
+    from liquidata import pipe
+    running, peak = 0, 0
+    async def track(n):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await sleep(0.001)
+        running -= 1
+        return n
+    assert run(pipe(track, concurrency=concurrency)(range(20))) == list(range(20))
+    assert peak == concurrency
+
+
+@parametrize('batch', (None, 100))
+def test_into_is_lazy(batch):
+    from liquidata import pipe, out, into, _Into
+    produced = 0
+    def source(n):
+        nonlocal produced
+        for produced in range(1, n+1):
+            yield produced
+    lag = 0
+    def consumer(items):
+        nonlocal lag
+        for consumed, _ in enumerate(items, 1):
+            lag = max(lag, produced - consumed)
+        return consumed
+    n = 50 * _Into.CHUNK
+    assert pipe(out(into(consumer, lazy=True)), batch=batch)(source(n)) == n
+    assert lag < 10 * max(_Into.CHUNK, batch or 0)
+
+
+@parametrize('lazy', (False, True))
+@parametrize('batch', (None, 100))
+def test_into_runs_consumer_on_calling_thread_unless_lazy(lazy, batch):
+    from liquidata import pipe, out, into
+    import threading
+    def consumer(items):
+        return sum(items), threading.get_ident()
+    total, thread = pipe(out(into(consumer, lazy=lazy)), batch=batch)(range(3000))
+    assert total == sum(range(3000))
+    assert (thread == threading.get_ident()) is not lazy
+
+
+@parametrize('consumer', (sum, max, min, len, len_of_iterable, first))
+@parametrize('lazy', (False, True))
+@parametrize('batch', (None, 7))
+def test_into_streamed_consumers(consumer, lazy, batch):
+    from liquidata import pipe, out, into
+    data = range(3000)
+    assert pipe(out.X(into(consumer, lazy=lazy)), batch=batch)(data).X == consumer(list(data))
+
+
+@parametrize('data', ([True, True], [-0.0], [2.5, 1]))
+@parametrize('batch', (None, 7))
+def test_into_sum_matches_sum(data, batch):
+    from liquidata import pipe, out, into
+    got = pipe(out(into(sum)), batch=batch)(data)
+    assert got == sum(data)
+    assert type(got) is type(sum(data))
+    assert str(got) == str(sum(data))
+
+
+@parametrize('data', (['a', 'b'], [[1], [2]]))
+@parametrize('batch', (None, 7))
+def test_into_sum_rejects_what_sum_rejects(data, batch):
+    from liquidata import pipe, out, into
+    with raises(TypeError):
+        pipe(out(into(sum)), batch=batch)(data)
+
+
+@parametrize('consumer', (sum, len))
+@parametrize('batch', (None, 7))
+def test_into_incremental_consumers_on_empty_stream(consumer, batch):
+    from liquidata import pipe, out, into
+    assert pipe(out(into(consumer)), batch=batch)([]) == consumer([])
+
+
+def test_into_on_empty_stream():
+    from liquidata import pipe, out, into
+    assert pipe(out(into(sum)))([]) == 0
+
+
+def test_into_consumer_exception_propagates():
+    from liquidata import pipe, out, into
+    def fail(items):
+        for item in items:
+            if item == 2000:
+                raise KeyError(item)
+    with raises(KeyError):
+        pipe(out(into(fail)))(range(5000))
+    with raises(KeyError):
+        pipe(out(into(fail, lazy=True)))(range(5000))
+
+
+def column_networks():
+    from liquidata import out, into, take, flat, arg as _
+    return (( _ + 1, {_ > 30}, _ * 2                       ),
+            ( square, {odd}                                ),
+            ( {odd : _ + 1}, -_                            ),
+            ( [{_ > 10}, out.big(add)], out.all(max)       ),
+            ( _ * 1.5, _ / 7, out(add)                     ),
+            ( _ - 50, out(min, 1000)                       ),
+            ( {_ < 50}, take(7)                            ),
+            ( flat(range), {_ > 3}, out(into(sum))         ),
+            ( _ > 40, out.X(into(set))                     ),
+            ( [take(5, close_all=True), out.B], out.M      ),
+            ( {_ % 3}, _ + 1                               ),
+            ( {_ % 3 : _ - 1}, {_ % 4}                     ),
+            ( _ * 1.0e300, _ * 1.0e10, {_ > 1e305}          ),
+    )
+
+@parametrize('columns', (1, 7, 1000))
+@parametrize('components', column_networks())
+def test_column_mode_matches_item_mode(components, columns):
+    from pytest import importorskip
+    importorskip('numpy')
+    from liquidata import pipe
+    data = list(range(100))
+    got      = pipe(*components, columns=columns)(data)
+    expected = pipe(*components                 )(data)
+    assert got == expected
+    assert type(got) == type(expected)
+
+
+@parametrize('data', ([1, 2.5, 3], [2**70, 1, 2], [2**63, 1], ['a', 'bb'], [(1, 2), (3, 4)], [True, False]))
+def test_column_mode_preserves_values(data):
+    from pytest import importorskip
+    importorskip('numpy')
+    from liquidata import pipe, out, arg as _
+    assert pipe(out, columns=2)(data) == data
+    assert pipe(out(max), columns=2)(data) == max(data)
+
+
+@parametrize('op', (lambda x: 1 / (x - 50), lambda x: (x - 50) // 0, lambda x: 1.5 % (x - 50),
+                    lambda x: (x * 1.0) ** 200))
+@parametrize('columns', (1, 7, 1000))
+def test_column_mode_raises_where_item_mode_does(op, columns):
+    from pytest import importorskip
+    importorskip('numpy')
+    from liquidata import pipe, arg as _
+    import warnings
+    expression = op(_)
+    with raises(Exception) as expected:
+        pipe(expression)(range(100))
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        with raises(expected.type):
+            pipe(expression, columns=columns)(range(100))
+        with raises(expected.type):
+            pipe({expression}, columns=columns)(range(100))
+
+
+@parametrize('op, data', ((lambda x: x * 2**62         , [3, 4]              ),
+                          (lambda x: x ** 2            , [2**40, 3]          ),
+                          (lambda x: x + 1             , [2**63 - 1, 3]      ),
+                          (lambda x: -x                , [-2**63, 3]         ),
+                          (lambda x: abs(x)            , [-2**63, 3]         ),
+                          (lambda x: x * 2**62 // 2**62, [3, 4]              ),
+                          (lambda x: x ** -1           , [2, 4]              ),
+                          (lambda x: x / 3             , [2**60 + 1, 3]      ),
+                          (lambda x: ~x                , [True, False, True] ),
+                          (lambda x: -x                , [True, False, True] ),
+                          (lambda x: x - x             , [True, False, True] ),
+                          (lambda x: x + x             , [True, False, True] ),
+                          (lambda x: (x > 1) + (x > 0) , [0, 1, 2]           ),
+))
+@parametrize('columns', (1, 2, 1000))
+def test_column_mode_arithmetic_matches_item_mode(op, data, columns):
+    from pytest import importorskip
+    importorskip('numpy')
+    from liquidata import pipe, out, arg as _
+    expression = op(_)
+    for components in ((expression, out), ({expression}, out), ({expression : _ + 1}, out)):
+        got      = pipe(*components, columns=columns)(data)
+        expected = pipe(*components                 )(data)
+        assert got == expected
+        assert list(map(type, got)) == list(map(type, expected))
+
+
+def test_column_mode_float_sum_is_sequential():
+    from pytest import importorskip
+    importorskip('numpy')
+    from liquidata import pipe, out
+    data = [0.1 * n for n in range(1000)]
+    assert pipe(out(add), columns=64)(data) == reduce(add, data)
+
+
+def test_column_and_batch_are_exclusive():
+    from liquidata import pipe
+    with raises(ValueError):
+        pipe(odd, batch=3, columns=3)
+
+
+def test_graph_describes_components():
+    from liquidata import pipe, out, star, dispatch
+    graph = pipe(square, {odd}, [str, out.s], dispatch(odd, {True: out.odd}), star(max), out.n).graph()
+    assert [(n.kind, n.label, n.fn, n.starred, n.output, n.cap) for n in graph.nodes] == [
+        ('map'     , 'Map(square)'   , 'square'   , False, None , False),
+        ('filter'  , 'Filter(odd)'   , 'odd'      , False, None , False),
+        ('branch'  , 'Branch'        , None       , False, None , False),
+        ('dispatch', 'dispatch'      , 'odd'      , False, None , False),
+        ('map'     , 'Map(star(max))', 'star(max)', True , None , False),
+        ('out'     , 'out.n'         , None       , False, 'n'  , True )]
+    (_, branch), = graph.nodes[2].branches
+    assert [n.label for n in branch.nodes] == ['Map(str)', 'out.s']
+    (case, odds), = graph.nodes[3].branches
+    assert case == 'case True'
+    assert odds.outputs() == ['odd']
+    assert graph.outputs() == ['s', 'odd', 'n']
+
+
+def test_graph_caps_pipe_with_implicit_out():
+    from liquidata import pipe
+    last = pipe(square).graph().nodes[-1]
+    assert (last.kind, last.output, last.cap, last.implicit) == ('out', 'return', True, True)
+
+
+def test_graph_export():
+    import json
+    from liquidata import pipe, out
+    graph = pipe(square, [{odd}, out.odd], out.all).graph()
+    exported = json.loads(graph.to_json())
+    assert exported == graph.as_dict()
+    assert [n['label'] for n in exported['nodes']] == ['Map(square)', 'Branch', 'out.all']
+    branch, = exported['nodes'][1]['branches']
+    assert [n['output'] for n in branch['graph']['nodes']] == [None, 'odd']
+    dot = graph.to_dot()
+    assert dot.startswith('digraph pipe {')
+    assert '[label="Filter(odd)", shape=diamond]' in dot
+    assert 'n0 -> n1;' in dot
+    assert dot.count('->') == 4
+
+
+@mark.parametrize('components, problem',
+                  ((lambda out:  (out.X, [square, out.X])           , 'out.X is used 2 times'                    ),
+                   (lambda out:  (out.X, square)                    , 'Map(square) unreachable after out.X'      ),
+                   (lambda out:  ([square], out.X)                  , 'Branch: no output or sink at end of branch'),
+                   (lambda out: ((square, out.X), out.Y)            , 'out.X is inside a nested pipe'            ),
+                  ))
+def test_validate_reports_problems(components, problem):
+    from liquidata import pipe, out, InvalidPipe
+    net = pipe(*components(out))
+    assert any(problem in p for p in net.graph().problems())
+    with raises(InvalidPipe) as e:
+        net.validate()
+    assert problem in str(e.value)
+
+
+def test_validate_accepts_sound_pipe():
+    from liquidata import pipe, out
+    net = pipe(square, [{odd}, out.odd], [{even}, out], out.all)
+    assert net.graph().problems() == []
+    assert net.validate() is net
+
+
+@mark.parametrize('batch', (None, 3))
+def test_profile_counts_items_through_stages_and_branches(batch):
+    from liquidata import pipe, out, arg
+    net = pipe(square, [{odd}, out.odd], {arg > 10}, out.big, batch=batch)
+    data = range(10)
+    profile = net.profile(data)
+    assert vars(profile.result) == vars(net(data))
+    report = profile.as_dict()
+    stages = [(s['name'], s['items_in'], s['items_out']) for s in report['stages']]
+    assert stages == [('Map(square)'         , 10,   10),
+                      ('Branch'              , 10,   10),
+                      ('Filter((arg > 10))'  , 10,    6),
+                      ('out.big'             ,  6, None)]
+    branch, = report['stages'][1]['branches']
+    assert [(s['name'], s['items_in'], s['ratio']) for s in branch] == [('Filter(odd)', 10, 0.5),
+                                                                       ('out.odd'    ,  5, None)]
+    assert all(0 <= s['self_time'] <= s['time'] <= report['time'] for s in report['stages'])
+
+
+def test_profile_table():
+    from liquidata import pipe, out, flat
+    table = str(pipe(square, [out.sq], (square, flat(range)), out.n).profile(range(4)))
+    assert table.splitlines()[0].split() == ['stage', 'in', 'out', 'ratio', 'cumul', 'ms', 'self', 'ms']
+    assert '\n  out.sq ' in table
+    assert '\n  flat(range) ' in table
+
+
+def test_profile_leaves_normal_runs_uninstrumented():
+    from liquidata import pipe, out
+    net = pipe(square, out)
+    net.profile(range(3))
+    assert net(range(3)) == [0, 1, 4]
@@ -21,3 +21,7 @@ def even(n): return n % 2 == 0
 def namespace_source(keys='abc', length=3):
     indices = range(length)
     return [Namespace(**{key:f'{key}{i}' for key in keys}) for i in indices]
+
+def reciprocal(n): return 1 / n
+def len_of_iterable(items): return sum(1 for _ in items)
+def first(items): return next(iter(items))